@@ -141,6 +141,22 @@ class WebhookAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(models.WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    date_hierarchy = "received_at"
+    list_display = (
+        "__str__",
+        "project_remote_id",
+        "received_at",
+        "processed_at",
+        "attempts",
+    )
+    readonly_fields = ("project_remote_id", "payload", "received_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(models.Workspace)
 class WorkspaceAdmin(admin.ModelAdmin):
     exclude = ("resource_type",)
@@ -0,0 +1,252 @@
+"""Concurrent fetching from Asana with asyncio, used by the async sync engine.
+
+Requires the optional dependency httpx: ``pip install django-asana[async]``
+"""
+import asyncio
+import logging
+
+from asana.error import RateLimitEnforcedError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from djasana.connect import import_httpx, translate_httpx_error
+from djasana.rest import get_error
+from djasana.retry import RetryPolicy
+from djasana.utils import STORY_FIELDS, TASK_FIELDS, has_fields
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+
+
+def get_async_session(client):
+    """Returns an httpx.AsyncClient authenticated like the given asana client,
+    using HTTP/2 if DJASANA_HTTP2 is set."""
+    httpx = import_httpx()
+    headers = {}
+    token = getattr(client.session, "token", None)
+    if token:
+        headers["Authorization"] = "Bearer {}".format(token["access_token"])
+    kwargs = {}
+    timeout = getattr(getattr(client, "retry_policy", None), "timeout", None)
+    if timeout:
+        kwargs["timeout"] = timeout
+    return httpx.AsyncClient(
+        base_url=client.options["base_url"],
+        headers=headers,
+        auth=client.auth,
+        http2=getattr(settings, "DJASANA_HTTP2", False),
+        **kwargs,
+    )
+
+
+class AsyncFetcher(object):
+    """Fetches Asana resources concurrently on its own event loop.
+
+    At most `concurrency` requests are in flight at a time. Results are returned
+    keyed by (kind, gid), where kind is one of task, subtasks, attachments,
+    attachment, stories, or story. A request that fails is stored as its
+    exception, so the caller can handle it where it would have made the request.
+    Failed requests are retried as the retry_policy, by default from settings,
+    allows. With a circuit_breaker, requests fail with CircuitOpenError while it
+    is open.
+
+    With a rate_limiter, each request waits for a token from it, and
+    throttled_seconds is the time spent waiting.
+    """
+
+    def __init__(
+        self,
+        client,
+        concurrency=DEFAULT_CONCURRENCY,
+        session=None,
+        rate_limiter=None,
+        retry_policy=None,
+        circuit_breaker=None,
+    ):
+        self.client = client
+        self.concurrency = concurrency
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy.from_settings()
+        self.circuit_breaker = circuit_breaker
+        self.throttled_seconds = 0.0
+        self.page_size = client.options.get("page_size", 50)
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._skip_ids = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.aclose())
+        self.loop.close()
+
+    def fetch_tasks(self, tasks, attachments=True, stories=True, skip_ids=()):
+        """Fetches listed tasks with their subtasks and, optionally, their
+        attachments and stories.
+
+        A listed task that already has all of TASK_FIELDS is not fetched again,
+        and subtasks are only fetched for tasks that have some. Attachments and
+        stories with gids in skip_ids are listed but not fetched.
+        """
+        self._skip_ids = set(skip_ids)
+        return self.loop.run_until_complete(
+            self._fetch_tasks(tasks, attachments, stories)
+        )
+
+    async def _fetch_tasks(self, tasks, attachments, stories):
+        if self.session is None:
+            self.session = get_async_session(self.client)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        await asyncio.gather(
+            *(self._fetch_task(task, attachments, stories, results) for task in tasks)
+        )
+        return results
+
+    async def _fetch_task(self, task, attachments, stories, results):
+        task_id = task["gid"]
+        coroutines = [self._fetch_subtasks(results, task)]
+        if attachments:
+            coroutines.append(
+                self._fetch_children(
+                    results, task_id, "attachments", "attachment", "/attachments"
+                )
+            )
+        if stories:
+            coroutines.append(
+                self._fetch_children(
+                    results, task_id, "stories", "story", "/stories", STORY_FIELDS
+                )
+            )
+        await asyncio.gather(*coroutines)
+
+    async def _fetch_subtasks(self, results, task):
+        """Fetches the task if needed, then its subtasks if it has any."""
+        task_id = task["gid"]
+        if not has_fields(task, TASK_FIELDS):
+            # Asked for, so that num_subtasks is returned
+            task = await self._store(
+                results,
+                ("task", task_id),
+                self.get(f"/tasks/{task_id}", {"opt_fields": ",".join(TASK_FIELDS)}),
+            )
+            if isinstance(task, Exception):
+                return
+        if task.get("num_subtasks") == 0:
+            return
+        await self._store(
+            results,
+            ("subtasks", task_id),
+            self.get_collection(
+                f"/tasks/{task_id}/subtasks", {"opt_fields": ",".join(TASK_FIELDS)}
+            ),
+        )
+
+    async def _fetch_children(
+        self, results, task_id, kind, child_kind, child_path, fields=None
+    ):
+        """Fetches a listing of a task's children, then each child in full.
+
+        If fields are given, the listing requests them as opt_fields and only
+        children listed without all of them are fetched again.
+        """
+        params = {"opt_fields": ",".join(fields)} if fields else None
+        children = await self._store(
+            results,
+            (kind, task_id),
+            self.get_collection(f"/tasks/{task_id}/{kind}", params),
+        )
+        if isinstance(children, Exception):
+            return
+        await asyncio.gather(
+            *(
+                self._store(
+                    results,
+                    (child_kind, child["gid"]),
+                    self.get("{}/{}".format(child_path, child["gid"])),
+                )
+                for child in children
+                if child["gid"] not in self._skip_ids
+                and not (fields and has_fields(child, fields))
+            )
+        )
+
+    @staticmethod
+    async def _store(results, key, coroutine):
+        try:
+            results[key] = await coroutine
+        except Exception as error:
+            results[key] = error
+        return results[key]
+
+    async def get(self, path, params=None):
+        response = await self.request(path, params)
+        return response["data"]
+
+    async def get_collection(self, path, params=None):
+        """Returns all items of a collection, following pagination."""
+        params = dict(params or {}, limit=self.page_size)
+        items = []
+        while True:
+            response = await self.request(path, params)
+            items.extend(response["data"])
+            next_page = response.get("next_page")
+            if not next_page:
+                return items
+            params["offset"] = next_page["offset"]
+
+    async def _throttle(self):
+        while self.rate_limiter is not None:
+            wait = self.rate_limiter.take()
+            if not wait:
+                return
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    async def _call_breaker(self, name, *args):
+        # The breaker keeps its state in the Django cache, whose backends may not
+        # be used from the event loop
+        method = getattr(self.circuit_breaker, name)
+        return await sync_to_async(method, thread_sensitive=False)(*args)
+
+    async def request(self, path, params=None):
+        policy = self.retry_policy
+        attempt = 1
+        while True:
+            await self._throttle()
+            if self.circuit_breaker is not None:
+                await self._call_breaker("before_request")
+            try:
+                async with self._semaphore:
+                    logger.debug("get, %s", path)
+                    try:
+                        response = await self.session.get(path, params=params)
+                    except Exception as error:
+                        raise translate_httpx_error(error) from error
+                error = get_error(response)
+                if error is not None:
+                    raise error
+            except Exception as error:
+                if self.circuit_breaker is not None:
+                    await self._call_breaker("record", error)
+                if attempt >= policy.max_attempts or not policy.is_retryable(error):
+                    raise
+                delay = policy.get_delay(attempt - 1, error)
+                attempt += 1
+                if isinstance(error, RateLimitEnforcedError):
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.block(delay)
+                        continue
+                    self.throttled_seconds += delay
+                await asyncio.sleep(delay)
+            else:
+                if self.circuit_breaker is not None:
+                    await self._call_breaker("record")
+                return response.json()
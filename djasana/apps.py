@@ -6,4 +6,5 @@ class DjsanaConfig(AppConfig):
     verbose_name = "Asana"
 
     def ready(self):
-        pass
+        # Connects the receivers invalidating cached webhook secrets
+        from . import webhooks  # noqa: F401
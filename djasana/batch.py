@@ -0,0 +1,160 @@
+"""Grouping of GET requests into requests to Asana's batch API."""
+import logging
+import threading
+from concurrent.futures import Future
+from itertools import islice
+
+from asana.error import ServerError
+from django.conf import settings
+
+from .rest import get_error
+
+logger = logging.getLogger(__name__)
+
+# Asana accepts at most this many actions in a batch request.
+MAX_BATCH_SIZE = 10
+
+
+class BatchResponse(object):
+    """The response to one action of a batch request, like that of requests,
+    so that errors are raised as they would have been for the action alone."""
+
+    def __init__(self, result):
+        self.status_code = self.status = result["status_code"]
+        self.headers = result.get("headers") or {}
+        self.body = result.get("body") or {}
+
+    def json(self):
+        return self.body
+
+
+class BatchDispatcher(object):
+    """Groups the GET requests of a client into batch requests.
+
+    submit() queues a GET and returns a Future of its data. Queued GETs are sent
+    together when `size` of them are queued, when flush() is called, or
+    `max_wait` seconds after the first was queued, whichever comes first. Threads
+    may share a dispatcher, so the GETs of concurrent threads are grouped too.
+
+    Actions that fail with an error the client's retry policy would retry are
+    requested again on their own.
+    """
+
+    def __init__(self, client, size=MAX_BATCH_SIZE, max_wait=0.05):
+        self.client = client
+        self.size = max(min(size, MAX_BATCH_SIZE), 1)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = []
+        self._timer = None
+
+    def submit(self, path, params=None, fields=None):
+        """Queues a GET of the path, returning a Future of its data."""
+        future, batch = self._queue_get(path, params, fields, wait=True)
+        if batch:
+            self._send(batch)
+        return future
+
+    def flush(self):
+        """Sends the queued GETs now."""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def get_many(self, paths, fields=None):
+        """Returns the data of GETs of the paths, in order."""
+        futures = []
+        for path in paths:
+            # Sent below, so without waiting on the timer
+            future, batch = self._queue_get(path, None, fields)
+            futures.append(future)
+            if batch:
+                self._send(batch)
+        self.flush()
+        return [future.result() for future in futures]
+
+    def _queue_get(self, path, params, fields, wait=False):
+        """Queues a GET, returning its Future and the batch to send if the queue is
+        full. With wait, the queue is sent max_wait seconds later otherwise."""
+        future = Future()
+        with self._lock:
+            self._queue.append((path, params, fields, future))
+            if len(self._queue) >= self.size:
+                return future, self._take()
+            if wait and self._timer is None:
+                self._timer = threading.Timer(self.max_wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future, None
+
+    def _take(self):
+        batch, self._queue = self._queue, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _send(self, batch):
+        actions = []
+        for path, params, fields, _ in batch:
+            action = {"relative_path": path, "method": "get"}
+            if params:
+                action["data"] = params
+            if fields:
+                action["options"] = {"fields": list(fields)}
+            actions.append(action)
+        logger.debug("Batch of %s GETs", len(actions))
+        try:
+            results = self.client.post(
+                "/batch", {"actions": actions}, tokens=len(actions)
+            )
+            for (path, params, fields, future), result in zip(batch, results):
+                response = BatchResponse(result)
+                if response.status_code < 400:
+                    future.set_result(response.body["data"])
+                    continue
+                error = get_error(response) or ServerError(response)
+                if not self.client.retry_policy.is_retryable(error):
+                    future.set_exception(error)
+                    continue
+                try:
+                    future.set_result(
+                        self.client.get(path, params or {}, fields=fields)
+                    )
+                except Exception as error_:
+                    future.set_exception(error_)
+        except Exception as error:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            # So that no one waits forever on an action without a result
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(ServerError())
+
+
+def get_batch_dispatcher(client):
+    """Returns a BatchDispatcher for the client configured by DJASANA_BATCH, or
+    None if it is not set."""
+    options = getattr(settings, "DJASANA_BATCH", None)
+    if not options:
+        return None
+    return BatchDispatcher(client, **options)
+
+
+def find_by_ids(client, resource, remote_ids):
+    """Yields the objects of the resource, like tags, with the remote ids, as
+    calling find_by_id for each would, in batches if the client has a batcher."""
+    batcher = getattr(client, "batcher", None)
+    if batcher is None:
+        for remote_id in remote_ids:
+            yield getattr(client, resource).find_by_id(remote_id)
+        return
+    remote_ids = iter(remote_ids)
+    while True:
+        chunk = list(islice(remote_ids, batcher.size))
+        if not chunk:
+            return
+        yield from batcher.get_many(f"/{resource}/{remote_id}" for remote_id in chunk)
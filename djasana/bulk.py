@@ -0,0 +1,305 @@
+"""Buffered bulk writes of objects synced from Asana."""
+import logging
+from collections import OrderedDict, defaultdict
+
+from django.db import connections, models, router, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_SIZE = 500
+
+# Models are written in this order, so that rows are written before rows that
+# refer to them. Models not listed are written last.
+MODEL_ORDER = (
+    "workspace",
+    "user",
+    "team",
+    "tag",
+    "customfield",
+    "projectstatus",
+    "project",
+    "customfieldsetting",
+    "task",
+    "attachment",
+    "story",
+)
+
+
+class IdentityMap(object):
+    """The remote ids of objects known to be in the database, by model.
+
+    Preloaded in bulk, it answers whether an object exists from memory, so that
+    objects referred to again and again, like users, are not queried each time.
+    Only preloaded models are tracked.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def preload(self, model, queryset=None):
+        """Loads the remote ids of all objects of the model, or of the queryset."""
+        if queryset is None:
+            queryset = model.objects.all()
+        self._ids.setdefault(model, set()).update(
+            queryset.values_list("remote_id", flat=True)
+        )
+
+    def has(self, model, remote_id):
+        return model in self._ids and int(remote_id) in self._ids[model]
+
+    def update(self, model, remote_ids):
+        if model in self._ids:
+            self._ids[model].update(int(remote_id) for remote_id in remote_ids)
+
+    def discard(self, model, remote_ids):
+        if model in self._ids:
+            self._ids[model].difference_update(
+                int(remote_id) for remote_id in remote_ids
+            )
+
+
+class BulkWriter(object):
+    """Buffers records of Asana objects and writes them in chunks.
+
+    A record is a dict of model field values, including remote_id. Records of a
+    model are upserted on remote_id, or with update=False, only inserted if
+    missing, like get_or_create. Many-to-many relations are buffered by the
+    remote ids on both sides with set_related. When flush_size records are
+    buffered, or on flush(), all buffered records are written, then the rows of
+    the through tables of buffered relations are diffed against the desired rows,
+    inserting and deleting only the differences, all in one transaction.
+
+    With an IdentityMap, records with update=False of objects in the map are not
+    buffered at all, and written records are added to the map.
+    """
+
+    def __init__(self, flush_size=DEFAULT_FLUSH_SIZE, identity_map=None):
+        self.flush_size = flush_size
+        self.identity_map = identity_map
+        self._records = defaultdict(OrderedDict)
+        self._relations = defaultdict(dict)
+        self._size = 0
+
+    def add(self, model, record, update=True):
+        """Buffers a record to be written."""
+        record = self._normalize(model, record)
+        remote_id = record["remote_id"]
+        if (
+            not update
+            and self.identity_map is not None
+            and self.identity_map.has(model, remote_id)
+        ):
+            return
+        records = self._records[(model, update)]
+        if remote_id not in records:
+            self._size += 1
+        elif not update:
+            return
+        records[remote_id] = record
+        if self._size >= self.flush_size:
+            self.flush()
+
+    def set_related(self, model, remote_id, field_name, related_ids, clear=True):
+        """Buffers the remote ids of the objects related to an object by a
+        many-to-many field, like field.set(), or with clear=False, field.add().
+
+        Related objects that are not in the database when flushed are skipped.
+        """
+        related_ids = {int(related_id) for related_id in related_ids}
+        relations = self._relations[(model, field_name, clear)]
+        remote_id = int(remote_id)
+        if clear or remote_id not in relations:
+            relations[remote_id] = related_ids
+        else:
+            relations[remote_id] |= related_ids
+
+    def flush(self):
+        """Writes all buffered records, then all buffered relations."""
+        records, self._records = self._records, defaultdict(OrderedDict)
+        relations, self._relations = self._relations, defaultdict(dict)
+        self._size = 0
+        keys = list(records) + list(relations)
+        if not keys:
+            return
+        with transaction.atomic(using=self._db(keys[0][0])):
+            for model, update in sorted(records, key=self._write_order):
+                self._write(model, list(records[(model, update)].values()), update)
+            for (model, field_name, clear), related in relations.items():
+                self._write_relations(model, field_name, related, clear)
+        if self.identity_map is not None:
+            for (model, _), model_records in records.items():
+                self.identity_map.update(model, model_records)
+
+    @staticmethod
+    def _db(model):
+        return router.db_for_write(model)
+
+    @staticmethod
+    def _write_order(key):
+        """Sorts by MODEL_ORDER, with upserts before inserts of the same model."""
+        model, update = key
+        model_name = model._meta.model_name
+        index = (
+            MODEL_ORDER.index(model_name)
+            if model_name in MODEL_ORDER
+            else len(MODEL_ORDER)
+        )
+        return index, not update
+
+    @staticmethod
+    def _normalize(model, record):
+        """Returns a copy of the record with related instances replaced by the
+        values of their foreign keys."""
+        normalized = {}
+        for name, value in record.items():
+            if isinstance(value, models.Model):
+                field = model._meta.get_field(name)
+                name = field.attname
+                value = getattr(value, field.target_field.attname)
+            normalized[name] = value
+        normalized["remote_id"] = int(normalized["remote_id"])
+        if "gid" in normalized:
+            normalized["gid"] = str(normalized["remote_id"])
+        return normalized
+
+    @staticmethod
+    def _get_depths(model, records):
+        """Returns the number of ancestors each record has among the records,
+        through foreign keys of the model to itself, like the parent of a task."""
+        fields = [
+            field.attname
+            for field in model._meta.concrete_fields
+            if field.is_relation and field.related_model is model
+        ]
+        by_id = {record["remote_id"]: record for record in records}
+        depths = {}
+
+        def get_depth(record, seen):
+            remote_id = record["remote_id"]
+            if remote_id not in depths:
+                depth = 0
+                for field in fields:
+                    try:
+                        parent = by_id.get(int(record.get(field)))
+                    except (TypeError, ValueError):
+                        continue
+                    if parent is not None and parent["remote_id"] not in seen:
+                        depth = max(depth, 1 + get_depth(parent, seen | {remote_id}))
+                depths[remote_id] = depth
+            return depths[remote_id]
+
+        return [get_depth(record, frozenset()) for record in records]
+
+    def _write(self, model, records, update):
+        # Records of different fields are written separately, so that fields
+        # missing from a record are not overwritten with defaults. Records are
+        # written after those they refer to, like subtasks after their parents,
+        # for databases that check foreign keys at once.
+        groups = defaultdict(list)
+        for depth, record in zip(self._get_depths(model, records), records):
+            groups[(depth, tuple(sorted(record)))].append(record)
+        for (_, field_names), group in sorted(
+            groups.items(), key=lambda item: item[0][0]
+        ):
+            objs = [model(**record) for record in group]
+            for obj in objs:
+                obj.gid = obj.gid or str(obj.remote_id)
+            if update:
+                self._upsert(model, objs, self._get_update_fields(model, field_names))
+            else:
+                model.objects.bulk_create(
+                    objs, ignore_conflicts=True, batch_size=self.flush_size
+                )
+            logger.debug("Wrote %s %s records", len(objs), model._meta.model_name)
+
+    @staticmethod
+    def _get_pks(model, remote_ids):
+        return dict(
+            model.objects.filter(remote_id__in=remote_ids).values_list(
+                "remote_id", "pk"
+            )
+        )
+
+    def _write_relations(self, model, field_name, related, clear):
+        field = model._meta.get_field(field_name)
+        through = field.remote_field.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        source_pks = self._get_pks(model, related)
+        target_pks = self._get_pks(field.related_model, set().union(*related.values()))
+        desired = {
+            (source_pks[remote_id], target_pks[related_id])
+            for remote_id, related_ids in related.items()
+            if remote_id in source_pks
+            for related_id in related_ids
+            if related_id in target_pks
+        }
+        current = {}
+        for pk, source_pk, target_pk in through.objects.filter(
+            **{f"{source}__in": source_pks.values()}
+        ).values_list("pk", source, target):
+            current[(source_pk, target_pk)] = pk
+        through.objects.bulk_create(
+            [
+                through(**{source: source_pk, target: target_pk})
+                for source_pk, target_pk in desired - current.keys()
+            ],
+            batch_size=self.flush_size,
+        )
+        stale_pks = [pk for key, pk in current.items() if key not in desired]
+        if clear and stale_pks:
+            through.objects.filter(pk__in=stale_pks).delete()
+
+    @staticmethod
+    def _get_update_fields(model, field_names):
+        update_fields = ["gid"]
+        for name in field_names:
+            field = model._meta.get_field(name)
+            if field.primary_key or name in ("gid", "remote_id"):
+                continue
+            if getattr(field, "auto_now_add", False):
+                continue  # Like update_or_create, which does not change it.
+            update_fields.append(field.name)
+        return update_fields
+
+    def _upsert(self, model, objs, update_fields):
+        features = connections[self._db(model)].features
+        if getattr(features, "supports_update_conflicts_with_target", False):
+            model.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=["remote_id"],
+                update_fields=update_fields,
+                batch_size=self.flush_size,
+            )
+        elif getattr(features, "supports_update_conflicts", False):
+            model.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                update_fields=update_fields,
+                batch_size=self.flush_size,
+            )
+        else:
+            # Django before 4.1 does not support upserts.
+            pks = dict(
+                model.objects.filter(
+                    remote_id__in=[obj.remote_id for obj in objs]
+                ).values_list("remote_id", "pk")
+            )
+            existing = []
+            for obj in objs:
+                if obj.remote_id in pks:
+                    obj.pk = pks[obj.remote_id]
+                    existing.append(obj)
+            model.objects.bulk_create(
+                [obj for obj in objs if obj.remote_id not in pks],
+                batch_size=self.flush_size,
+            )
+            if existing:
+                for obj in existing:
+                    for field in model._meta.concrete_fields:
+                        if getattr(field, "auto_now", False):
+                            field.pre_save(obj, False)
+                model.objects.bulk_update(
+                    existing, update_fields, batch_size=self.flush_size
+                )
@@ -1,37 +1,403 @@
+import hashlib
 import logging
-from requests.exceptions import ChunkedEncodingError
+import os
+import tempfile
+import threading
+import time
 
 from asana import Client as AsanaClient
-from asana.error import ServerError
+from asana.error import RateLimitEnforcedError, RetryableAsanaError
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+from djasana.batch import get_batch_dispatcher
+from djasana.ratelimit import TokenBucket
+from djasana.rest import RestClient
+from djasana.retry import RetryPolicy
 
 
 logger = logging.getLogger(__name__)
 
+# Settings that a client made by client_connect depends on.
+CLIENT_SETTINGS = (
+    "ASANA_ACCESS_TOKEN",
+    "ASANA_CLIENT_ID",
+    "ASANA_CLIENT_SECRET",
+    "ASANA_OAUTH_REDIRECT_URI",
+    "ASANA_WORKSPACE",
+    "DJASANA_CLIENT_CLASS",
+)
 
-class Client(AsanaClient, object):
-    """An http client for making requests to an Asana API and receiving responses."""
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to Asana while the circuit breaker is
+    open. retry_after is the number of seconds until requests are tried again."""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super(CircuitOpenError, self).__init__(
+            f"Asana is failing; not making requests for {retry_after:.0f} seconds"
+        )
+
+
+class CircuitBreaker(object):
+    """Stops requests to Asana while it is failing.
+
+    After `threshold` consecutive server errors or timeouts, the circuit opens
+    and requests fail fast with CircuitOpenError for `cooldown` seconds. Then
+    one request at a time is let through as a probe: if it succeeds the circuit
+    closes, and if it fails the circuit opens again. The state is kept in the
+    Django cache, so a shared cache shares it across processes.
+    """
+
+    def __init__(self, threshold=5, cooldown=60, key="djasana-circuit-breaker"):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.key = key
+
+    @staticmethod
+    def is_failure(error):
+        """Whether the error suggests Asana is down. Rate limits and client
+        errors do not."""
+        return isinstance(
+            error, (RetryableAsanaError, ChunkedEncodingError, ConnectionError, Timeout)
+        ) and not isinstance(error, RateLimitEnforcedError)
+
+    def before_request(self):
+        """Raises CircuitOpenError if a request may not be made now."""
+        opened_until = cache.get(f"{self.key}:opened_until")
+        if opened_until is None:
+            return
+        now = time.time()
+        if now < opened_until:
+            raise CircuitOpenError(opened_until - now)
+        # Half open: let a single request through to probe.
+        if not cache.add(f"{self.key}:probe", now, timeout=self.cooldown):
+            raise CircuitOpenError(self.cooldown)
+
+    def record(self, error=None):
+        """Records the outcome of a request, that failed with error if given."""
+        if error is None:
+            self.record_success()
+        elif self.is_failure(error):
+            self.record_failure()
+        elif not isinstance(error, RateLimitEnforcedError):
+            self.record_success()  # Asana responded
+
+    def record_success(self):
+        if cache.get(f"{self.key}:failures"):
+            cache.delete_many(
+                [
+                    f"{self.key}:failures",
+                    f"{self.key}:opened_until",
+                    f"{self.key}:probe",
+                ]
+            )
+            logger.info("Closed the circuit breaker; Asana has recovered")
+
+    def record_failure(self):
+        key = f"{self.key}:failures"
+        cache.add(key, 0, timeout=None)
+        try:
+            failures = cache.incr(key)
+        except ValueError:  # Evicted meanwhile
+            cache.set(key, 1, timeout=None)
+            failures = 1
+        if failures >= self.threshold:
+            cache.set(
+                f"{self.key}:opened_until", time.time() + self.cooldown, timeout=None
+            )
+            cache.delete(f"{self.key}:probe")
+            logger.error(
+                "Opened the circuit breaker after %s consecutive errors; "
+                "not making requests to Asana for %s seconds",
+                failures,
+                self.cooldown,
+            )
+
+
+class HTTPXResponse(object):
+    """An httpx response standing in for a requests response, as the errors of
+    python-asana expect: it has a status, and is false for error statuses."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = self.status = response.status_code
+        self.headers = response.headers
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    @property
+    def ok(self):
+        return bool(self)
+
+    @property
+    def content(self):
+        return self.response.content
+
+    @property
+    def text(self):
+        return self.response.text
+
+    def json(self):
+        return self.response.json()
+
+
+class HTTPXTransport(object):
+    """Sends the requests of a Client with httpx instead of requests, over HTTP/2
+    if DJASANA_HTTP2 is set, so that requests share a few connections.
+
+    It stands in for the requests session of the Client: its responses are
+    HTTPXResponses, and its errors are raised as the requests errors the Client
+    and its retry policy expect.
+    Requires httpx, or httpx[http2] for HTTP/2: pip install django-asana[http2]
+    """
+
+    def __init__(self, token=None, http2=False, pool_size=None):
+        self.httpx = import_httpx()
+        # Shaped like the token of an OAuth2 session, which the async engine
+        # and from_client read
+        self.token = {"access_token": token} if token else None
+        headers = {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        kwargs = {}
+        if pool_size:
+            kwargs["limits"] = self.httpx.Limits(max_connections=pool_size)
+        self.session = self.httpx.Client(http2=http2, headers=headers, **kwargs)
+
+    @classmethod
+    def from_client(cls, client):
+        """Returns a transport authenticated like the client's session."""
+        token = getattr(client.session, "token", None) or {}
+        return cls(
+            token=token.get("access_token"),
+            http2=getattr(settings, "DJASANA_HTTP2", False),
+            pool_size=getattr(settings, "DJASANA_POOL_SIZE", None),
+        )
+
+    def request(self, method, url, auth=None, data=None, verify=None, **kwargs):
+        if auth is not None:
+            kwargs["auth"] = auth
+        try:
+            response = self.session.request(method.upper(), url, content=data, **kwargs)
+        except self.httpx.TimeoutException as error:
+            raise Timeout(error)
+        except self.httpx.TransportError as error:
+            raise ConnectionError(error)
+        return HTTPXResponse(response)
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("delete", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def translate_httpx_error(error):
+    """Returns the requests error an httpx error stands for, as the retry policy
+    and circuit breaker expect, or else the error itself."""
+    try:
+        import httpx
+    except ImportError:
+        return error
+    if isinstance(error, httpx.TimeoutException):
+        return Timeout(error)
+    if isinstance(error, httpx.TransportError):
+        return ConnectionError(error)
+    return error
+
+
+def import_httpx():
+    """Returns the httpx module, required by the async sync engine and by
+    HTTPXTransport."""
+    try:
+        import httpx
+    except ImportError:
+        raise ImproperlyConfigured(
+            "httpx is required. Install it with: pip install django-asana[async]"
+        )
+    return httpx
+
+
+class RequestPolicyMixin(object):
+    """Makes the requests of a client as djasana's settings say.
+
+    Failed requests are retried as its retry_policy, by default from the
+    DJASANA_RETRY_POLICY setting, allows.
+
+    If it has a rate_limiter, each request waits for a token from it, or as many
+    as its tokens option says, and a Retry-After from Asana blocks the rate
+    limiter for everyone sharing it.
+    throttled_seconds is the time this client has spent waiting on either.
+
+    If it has a circuit_breaker, requests raise CircuitOpenError while it is open.
+
+    If it has a batcher, a BatchDispatcher, batch.find_by_ids groups its GETs into
+    batch requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RequestPolicyMixin, self).__init__(*args, **kwargs)
+        self.batcher = None
+        self.circuit_breaker = None
+        self.rate_limiter = None
+        self.retry_policy = RetryPolicy.from_settings()
+        self.throttled_seconds = 0.0
+
+    def _throttle(self, tokens=1):
+        if self.rate_limiter is not None:
+            self.throttled_seconds += self.rate_limiter.acquire(tokens)
 
     def request(self, method, path, **options):
         logger.debug("%s, %s", method, path)
-        try:
-            return super(Client, self).request(method, path, **options)
-        except (SystemExit, ServerError, ChunkedEncodingError):
-            logger.error("Error for %s, %s with options %s", method, path, options)
-            # Try once more
-            return super(Client, self).request(method, path, **options)
+        policy = self.retry_policy
+        # A batch request counts as one request per action towards Asana's limit.
+        tokens = options.pop("tokens", 1)
+        # Retries are made here rather than by python-asana, as the policy says.
+        options["max_retries"] = 0
+        if (
+            policy.timeout
+            and "timeout" not in options
+            and "timeout" not in self.options
+        ):
+            options["timeout"] = policy.timeout
+        attempt = 1
+        while True:
+            self._throttle(tokens)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_request()
+            try:
+                response = super(RequestPolicyMixin, self).request(
+                    method, path, **options
+                )
+            except Exception as error:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(error)
+                if attempt >= policy.max_attempts or not policy.is_retryable(error):
+                    raise
+                delay = policy.get_delay(attempt - 1, error)
+                if isinstance(error, RateLimitEnforcedError):
+                    logger.warning(
+                        "Rate limit enforced; retrying after %s seconds", delay
+                    )
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.block(delay)
+                        delay = 0
+                    else:
+                        self.throttled_seconds += delay
+                else:
+                    logger.warning(
+                        "Error for %s, %s (attempt %s of %s); retrying after %.2f "
+                        "seconds: %r",
+                        method,
+                        path,
+                        attempt,
+                        policy.max_attempts,
+                        delay,
+                        error,
+                    )
+                if delay:
+                    time.sleep(delay)
+                attempt += 1
+            else:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record()
+                return response
+
+
+class Client(RequestPolicyMixin, AsanaClient):
+    """An http client for making requests to an Asana API and receiving responses."""
+
+    # Known options are not sent to Asana as parameters.
+    ALL_OPTIONS = AsanaClient.ALL_OPTIONS | {"tokens"}
+
+
+class NativeClient(RequestPolicyMixin, RestClient):
+    """A client using djasana's own lean REST client instead of python-asana's."""
+
+
+def get_rate_limiter():
+    """Returns the TokenBucket shared by clients on this host, or None if
+    DJASANA_RATE_LIMIT is not set."""
+    rate = getattr(settings, "DJASANA_RATE_LIMIT", None)
+    if not rate:
+        return None
+    path = getattr(settings, "DJASANA_RATE_LIMIT_FILE", None)
+    if not path:
+        # Asana limits each token separately.
+        credential = getattr(settings, "ASANA_ACCESS_TOKEN", None) or getattr(
+            settings, "ASANA_CLIENT_ID", ""
+        )
+        key = hashlib.sha256(str(credential).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(tempfile.gettempdir(), f"djasana-rate-limit-{key}.json")
+    return TokenBucket(rate, path)
+
+
+def get_circuit_breaker():
+    """Returns the CircuitBreaker configured by DJASANA_CIRCUIT_BREAKER, or None
+    if it is set to None."""
+    options = getattr(settings, "DJASANA_CIRCUIT_BREAKER", {})
+    if options is None:
+        return None
+    return CircuitBreaker(**options)
+
+
+def get_workspace_id(client, name):
+    """Returns the gid of the workspace with the name, or None.
+
+    Gids are cached for DJASANA_WORKSPACE_CACHE_TIMEOUT seconds, an hour by
+    default, so that the workspaces are not listed for every new client.
+    """
+    key = "djasana-workspace-id:" + hashlib.sha256(name.encode("utf-8")).hexdigest()
+    workspace_id = cache.get(key)
+    if workspace_id is None:
+        for workspace in client.workspaces.find_all():
+            if name == workspace["name"]:
+                workspace_id = workspace["gid"]
+        if workspace_id is not None:
+            cache.set(
+                key,
+                workspace_id,
+                getattr(settings, "DJASANA_WORKSPACE_CACHE_TIMEOUT", 3600),
+            )
+    return workspace_id
+
+
+def get_client_class():
+    """Returns the class of clients, by default Client, or that at the dotted
+    path DJASANA_CLIENT_CLASS, like djasana.connect.NativeClient."""
+    return import_string(
+        getattr(settings, "DJASANA_CLIENT_CLASS", None) or "djasana.connect.Client"
+    )
 
 
 def client_connect():
+    """Returns a new client configured by the settings."""
+    client_class = get_client_class()
     if getattr(settings, "ASANA_ACCESS_TOKEN", None):
-        client = Client.access_token(settings.ASANA_ACCESS_TOKEN)
+        client = client_class.access_token(settings.ASANA_ACCESS_TOKEN)
     elif (
         getattr(settings, "ASANA_CLIENT_ID", None)
         and getattr(settings, "ASANA_CLIENT_SECRET", None)
         and getattr(settings, "ASANA_OAUTH_REDIRECT_URI", None)
     ):
-        client = Client.oauth(
+        client = client_class.oauth(
             client_id=settings.ASANA_CLIENT_ID,
             client_secret=settings.ASANA_CLIENT_SECRET,
             redirect_uri=settings.ASANA_OAUTH_REDIRECT_URI,
@@ -41,11 +407,42 @@ def client_connect():
             "It is required to set the ASANA_ACCESS_TOKEN or the three OAuth2 settings "
             + "ASANA_CLIENT_ID, ASANA_CLIENT_SECRET, and ASANA_OAUTH_REDIRECT_URI."
         )
+    pool_size = getattr(settings, "DJASANA_POOL_SIZE", None)
+    transport = getattr(settings, "DJASANA_TRANSPORT", None)
+    if transport:
+        client.session = import_string(transport).from_client(client)
+    elif pool_size:
+        client.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+    client.batcher = get_batch_dispatcher(client)
+    client.circuit_breaker = get_circuit_breaker()
+    client.rate_limiter = get_rate_limiter()
 
     if getattr(settings, "ASANA_WORKSPACE", None):
-        workspaces = client.workspaces.find_all()
-        for workspace in workspaces:
-            if settings.ASANA_WORKSPACE == workspace["name"]:
-                client.options["workspace_id"] = workspace["gid"]
+        workspace_id = get_workspace_id(client, settings.ASANA_WORKSPACE)
+        if workspace_id is not None:
+            client.options["workspace_id"] = workspace_id
     client.options["Asana-Fast-Api"] = "true"
     return client
+
+
+_clients = threading.local()
+
+
+def get_client():
+    """Returns a client for the current thread, made with client_connect on
+    first use and kept to reuse its connections."""
+    key = tuple(getattr(settings, name, None) for name in CLIENT_SETTINGS)
+    if getattr(_clients, "key", None) != key:
+        _clients.client = client_connect()
+        _clients.key = key
+    return _clients.client
+
+
+def reset_clients(**kwargs):
+    """Discards the client of the current thread, so the next is made anew."""
+    _clients.__dict__.clear()
+
+
+setting_changed.connect(reset_clients)
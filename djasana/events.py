@@ -0,0 +1,265 @@
+"""Applying the events Asana delivers to webhooks to the database."""
+import logging
+from collections import defaultdict
+
+from asana.error import ForbiddenError, NotFoundError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from requests.packages.urllib3.exceptions import RequestError
+
+from .models import Project, Task, User
+from .utils import (
+    parse_remote_datetime,
+    sync_project,
+    sync_story,
+    sync_task,
+    sync_attachment,
+)
+
+logger = logging.getLogger(__name__)
+
+# The types of the resources events sync by fetching them from Asana
+SYNCED_RESOURCE_TYPES = ("project", "story", "task")
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return value
+
+
+def _boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError(value)
+    return value
+
+
+def _date(value):
+    if not value:
+        return None
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(value)
+    return date
+
+
+def _datetime(value):
+    if not value:
+        return None
+    datetime = parse_remote_datetime(value)
+    if datetime is None:
+        raise ValueError(value)
+    return datetime
+
+
+def _user_id(value):
+    if value is None:
+        return None
+    if not User.objects.filter(remote_id=value["gid"]).exists():
+        raise ValueError(value)
+    return value["gid"]
+
+
+# The task fields that changes to are applied without fetching the task, as the
+# Task field set and a function of the new value returning its value, raising
+# an exception for values that cannot be applied.
+LOCAL_CHANGES = {
+    "assignee": ("assignee_id", _user_id),
+    "completed": ("completed", _boolean),
+    "due_at": ("due_at", _datetime),
+    "due_on": ("due_on", _date),
+    "name": ("name", _text),
+    "notes": ("notes", _text),
+    "start_on": ("start_on", _date),
+}
+
+
+def get_local_change(event):
+    """Returns the change block of an event if it is a change to a task field
+    in LOCAL_CHANGES with its new value, else None."""
+    resource = event.get("resource") or {}
+    resource_type = resource.get("resource_type") or event.get("type")
+    change = event.get("change") or {}
+    if (
+        event["action"] == "changed"
+        and resource_type == "task"
+        and change.get("action") == "changed"
+        and change.get("field") in LOCAL_CHANGES
+        and "new_value" in change
+    ):
+        return change
+    return None
+
+
+def apply_change(event):
+    """Writes the change an event carries to its task, without fetching it.
+
+    Returns False if the change is not one of LOCAL_CHANGES, the task has not been
+    synced, or the new value cannot be applied, as for an assignee not yet synced;
+    the task should be fetched instead. Changes made before the task was last
+    synced are already reflected, and are left.
+    """
+    change = get_local_change(event)
+    if change is None:
+        return False
+    task = (
+        Task.objects.filter(remote_id=event["resource"]["gid"])
+        .only("remote_modified_at")
+        .first()
+    )
+    if task is None:
+        return False
+    try:
+        created_at = _datetime(event.get("created_at"))
+    except (TypeError, ValueError):
+        created_at = None
+    if created_at is None:
+        return False
+    if task.remote_modified_at and created_at <= task.remote_modified_at:
+        logger.debug("Change to task %s already synced", task.remote_id)
+        return True
+    field, get_value = LOCAL_CHANGES[change["field"]]
+    try:
+        values = {field: get_value(change["new_value"])}
+    except (KeyError, TypeError, ValueError):
+        logger.debug("Cannot apply change %s", change)
+        return False
+    if field == "completed":
+        values["completed_at"] = created_at if values["completed"] else None
+    values["modified_at"] = timezone.now()
+    Task.objects.filter(pk=task.pk).update(**values)
+    logger.debug("Applied change of %s to task %s", change["field"], task.remote_id)
+    return True
+
+
+def get_resource_key(event):
+    """Returns the type and gid of the resource an event syncs, or None if the
+    event does not fetch one, as for deletions."""
+    if event["action"] in ("deleted", "removed", "sync_error"):
+        return None
+    resource = event.get("resource") or {}
+    if resource.get("resource_type") not in SYNCED_RESOURCE_TYPES:
+        return None
+    return resource["resource_type"], resource["gid"]
+
+
+def coalesce(events, get_event=None):
+    """Collapses the events that sync the same resource into the last of them
+    that fetches it.
+
+    Returns (event, collapsed) pairs in the order of the events kept, where
+    collapsed are the earlier events that syncing the resource again for event
+    makes redundant. Changes that may be applied without fetching the resource
+    are only collapsed into a later fetch. get_event returns the event dict of an
+    item of events, for events kept in models.
+    """
+    get_event = get_event or (lambda event: event)
+    keys = [get_resource_key(get_event(event)) for event in events]
+    last = {
+        key: index
+        for index, key in enumerate(keys)
+        if key is not None and get_local_change(get_event(events[index])) is None
+    }
+    collapsed = defaultdict(list)
+    coalesced = []
+    for index, (event, key) in enumerate(zip(events, keys)):
+        if key is not None and last.get(key, index) > index:
+            collapsed[key].append(event)
+        else:
+            coalesced.append((event, collapsed.pop(key, [])))
+    return coalesced
+
+
+class EventProcessor(object):
+    """Syncs the objects that webhook events of a project are about.
+
+    Each resource is fetched at most once per processor: events about the same
+    resource are collapsed into the last of them, and a task synced as the parent
+    of another is not synced again for its own events. collapsed counts the
+    events skipped. Changes to task fields in LOCAL_CHANGES are applied without
+    fetching the task, counted by applied.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.applied = 0
+        self.collapsed = 0
+        self.synced = set()
+
+    def process_events(self, events, project):
+        logger.debug("Processing events")
+        for event, collapsed in coalesce(events):
+            self.collapsed += len(collapsed)
+            self.process_event(event, project)
+
+    def process_event(self, event, project):
+        key = get_resource_key(event)
+        if key in self.synced:
+            logger.debug("Already synced %s %s", *key)
+            self.collapsed += 1
+            return
+        if apply_change(event):
+            self.applied += 1
+            return
+        if event["action"] == "deleted":
+            # Assumes its a task
+            Task.objects.filter(remote_id=event["resource"]["gid"]).delete()
+            self.synced.discard(("task", event["resource"]["gid"]))
+        elif event["action"] == "sync_error":
+            logger.warning(event["message"])
+        elif event["resource"]["resource_type"] == "project":
+            if event["action"] == "removed":
+                Project.objects.get(remote_id=event["resource"]["gid"]).delete()
+            else:
+                self._sync_project(project)
+                self.synced.add(key)
+        elif event["resource"]["resource_type"] == "task":
+            if event["action"] == "removed":
+                Task.objects.get(remote_id=event["resource"]["gid"]).delete()
+                self.synced.discard(("task", event["resource"]["gid"]))
+            else:
+                self._sync_task_id(event["resource"]["gid"], project)
+        elif event["resource"]["resource_type"] == "story":
+            self._sync_story_id(event["resource"]["gid"])
+            self.synced.add(key)
+
+    def _sync_project(self, project):
+        project_dict = self.client.projects.find_by_id(project.remote_id)
+        logger.debug("Sync project %s", project_dict["name"])
+        logger.debug(project_dict)
+        sync_project(self.client, project_dict)
+
+    def _sync_story_id(self, story_id):
+        try:
+            story_dict = self.client.stories.find_by_id(story_id)
+        except (RequestError, NotFoundError) as error:
+            logger.warning(
+                "This is probably a temporary connection issue; please sync: %s", error
+            )
+            return
+        except ForbiddenError:
+            return
+        logger.debug(story_dict)
+        story_dict.pop("gid", None)
+        sync_story(story_id, story_dict)
+
+    def _sync_task_id(self, task_id, project):
+        self.synced.add(("task", task_id))
+        try:
+            task_dict = self.client.tasks.find_by_id(task_id)
+        except (ForbiddenError, NotFoundError):
+            try:
+                Task.objects.get(remote_id=task_id).delete()
+            except Task.DoesNotExist:
+                pass
+            return
+        logger.debug("Sync task %s", task_dict["name"])
+        logger.debug(task_dict)
+        task_dict.pop("gid", None)
+        if task_dict["parent"]:
+            if ("task", task_dict["parent"]["gid"]) not in self.synced:
+                self._sync_task_id(task_dict["parent"]["gid"], project)
+            task_dict["parent_id"] = task_dict.pop("parent")["gid"]
+        task = sync_task(task_id, task_dict, project, sync_tags=True)
+        for attachment in self.client.attachments.find_by_task(task_id):
+            sync_attachment(self.client, task, attachment["gid"])
@@ -0,0 +1,228 @@
+"""Apply webhook events stored in the inbox to the database"""
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from operator import attrgetter
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from djasana.connect import CircuitOpenError, get_client
+from djasana.events import EventProcessor, coalesce
+from djasana.models import Project, WebhookEvent
+from djasana.settings import settings
+
+logger = logging.getLogger(__name__)
+
+COUNT_LABELS = {
+    "pruned": "processed events pruned",
+    "processed": "events processed",
+    "collapsed": "events collapsed into others about the same resource",
+    "applied": "changes applied without fetching the task",
+    "failed": "failed attempts",
+    "abandoned": "events abandoned after too many failed attempts",
+}
+
+
+class Command(BaseCommand):
+    """Apply webhook events stored in the inbox to the database"""
+
+    help = (
+        "Apply the webhook events stored when DJASANA_WEBHOOK_INBOX is set, "
+        "until none are left that are due"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="The number of events to take from the inbox at a time.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="The number of projects to process events of at once, each in "
+            "its own thread.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="The number of times to try an event before giving up on it.",
+        )
+        parser.add_argument(
+            "--retry-delay",
+            type=int,
+            default=60,
+            help="Seconds to wait before retrying a failed event, doubled for each "
+            "further failure.",
+        )
+        parser.add_argument(
+            "--claim-timeout",
+            type=int,
+            default=600,
+            help="Seconds the events taken by a run are held from other runs, in "
+            "case it stops before it releases them.",
+        )
+        parser.add_argument(
+            "--prune-days",
+            type=int,
+            help="Delete events processed more than this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = max(options.get("batch_size") or 100, 1)
+        self.workers = max(options.get("workers") or 1, 1)
+        self.max_attempts = max(options.get("max_attempts") or 5, 1)
+        self.retry_delay = max(options.get("retry_delay") or 0, 0)
+        self.claim_timeout = max(options.get("claim_timeout") or 600, 1)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        if options.get("prune_days") is not None:
+            self._prune(options["prune_days"])
+        try:
+            while True:
+                events = self._claim_batch()
+                if not events:
+                    break
+                groups = OrderedDict()
+                for event in events:
+                    groups.setdefault(event.project_remote_id, []).append(event)
+                if self.workers > 1:
+                    with ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="process_asana_events",
+                    ) as executor:
+                        for _ in executor.map(
+                            self._process_events_in_worker, groups.values()
+                        ):
+                            pass
+                else:
+                    for project_events in groups.values():
+                        self._process_events(project_events)
+        except CircuitOpenError as error:
+            message = f"Stopped: {error}"
+            self.stdout.write(self.style.WARNING(message))
+            logger.warning(message)
+        if options.get("verbosity", 0) >= 1:
+            self.stdout.write(
+                "; ".join(
+                    f"{self.counts[key]} {label}" for key, label in COUNT_LABELS.items()
+                )
+            )
+
+    def _prune(self, days):
+        deleted, _ = WebhookEvent.objects.filter(
+            processed_at__lt=timezone.now() - timedelta(days=days)
+        ).delete()
+        self._count("pruned", deleted)
+
+    def _claim_batch(self):
+        """Takes the next events due to be processed, in the order received.
+
+        Projects with an event waiting to be retried are left out, so that the
+        events of a project are applied in order. Events received within the last
+        DJASANA_WEBHOOK_DEBOUNCE seconds are left for a later batch, so that the
+        events of an edit are collapsed together.
+
+        The events taken are locked, skipping those another run has locked, and
+        held from other runs until claim_timeout seconds from now, so that
+        overlapping runs do not process them twice. Their projects then wait for
+        them as for an event to be retried.
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            pending = WebhookEvent.objects.filter(
+                processed_at__isnull=True,
+                attempts__lt=self.max_attempts,
+                received_at__lte=now
+                - timedelta(seconds=settings.DJASANA_WEBHOOK_DEBOUNCE),
+            )
+            waiting = pending.filter(process_after__gt=now)
+            events = list(
+                pending.exclude(
+                    project_remote_id__in=waiting.values("project_remote_id")
+                )
+                .select_for_update(skip_locked=True)
+                .order_by("id")[: self.batch_size]
+            )
+            WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                process_after=now + timedelta(seconds=self.claim_timeout)
+            )
+        return events
+
+    def _process_events_in_worker(self, events):
+        try:
+            self._process_events(events)
+        finally:
+            connections.close_all()
+
+    def _process_events(self, events):
+        """Applies the events of one project in order, stopping at a failure.
+
+        Events collapsed into a later event are marked processed with it. Those
+        left unprocessed, but for a failed event, are released for the next batch.
+        """
+        project = Project.objects.filter(remote_id=events[0].project_remote_id).first()
+        if project is None:
+            logger.info(
+                "Project %s no longer exists; discarding its events",
+                events[0].project_remote_id,
+            )
+            WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                processed_at=timezone.now()
+            )
+            return
+        processor = EventProcessor(get_client())
+        failed = None
+        try:
+            for event, collapsed in coalesce(events, get_event=attrgetter("payload")):
+                try:
+                    with transaction.atomic():
+                        processor.process_event(event.payload, project)
+                        WebhookEvent.objects.filter(
+                            pk__in=[event.pk] + [other.pk for other in collapsed]
+                        ).update(processed_at=timezone.now())
+                except CircuitOpenError:
+                    raise
+                except Exception as error:
+                    failed = event
+                    self._fail(event, error)
+                    return
+                processor.collapsed += len(collapsed)
+                self._count("processed", 1 + len(collapsed))
+        finally:
+            WebhookEvent.objects.filter(
+                pk__in=[event.pk for event in events if event is not failed],
+                processed_at__isnull=True,
+            ).update(process_after=timezone.now())
+            self._count("collapsed", processor.collapsed)
+            self._count("applied", processor.applied)
+
+    def _count(self, key, count=1):
+        with self._lock:
+            self.counts[key] += count
+
+    def _fail(self, event, error):
+        event.attempts += 1
+        event.error = repr(error)
+        event.process_after = timezone.now() + timedelta(
+            seconds=self.retry_delay * 2 ** (event.attempts - 1)
+        )
+        event.save(update_fields=["attempts", "error", "process_after"])
+        self._count("failed")
+        if event.attempts >= self.max_attempts:
+            self._count("abandoned")
+            logger.error(
+                "Giving up on event %s after %s attempts: %r",
+                event.pk,
+                event.attempts,
+                error,
+            )
+        else:
+            logger.warning("Failed to process event %s: %r", event.pk, error)
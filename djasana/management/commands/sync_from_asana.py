@@ -1,15 +1,28 @@
 """The django management command sync_from_asana"""
 import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
 from asana.error import NotFoundError, InvalidTokenError, ForbiddenError
 from django.apps import apps
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
 
-from djasana.connect import client_connect
+from djasana.aio import DEFAULT_CONCURRENCY, AsyncFetcher
+from djasana.batch import find_by_ids
+from djasana.bulk import DEFAULT_FLUSH_SIZE, BulkWriter, IdentityMap
+from djasana.connect import CircuitOpenError, client_connect
+from djasana.events import apply_change
 from djasana.models import (
     Attachment,
     Project,
+    ProjectSync,
     Story,
+    SyncCheckpoint,
     SyncToken,
     Tag,
     Task,
@@ -20,30 +33,103 @@ from djasana.models import (
 )
 from djasana.settings import settings
 from djasana.utils import (
+    STORY_FIELDS,
+    TASK_FIELDS,
+    has_fields,
     pop_unsupported_fields,
     set_webhook,
+    get_unchanged_task,
     sync_attachment,
     sync_project,
+    sync_stories,
     sync_story,
     sync_task,
 )
 
 logger = logging.getLogger(__name__)
 
+# With the async engine, tasks are fetched and saved in batches of this many
+# times the concurrency.
+ASYNC_BATCH_FACTOR = 10
+
+# Descriptions of the counts reported in the summary at the end of a run.
+COUNT_LABELS = {
+    "subtask_requests_avoided": "subtask requests avoided",
+    "known_attachments_skipped": "known attachments skipped",
+    "known_stories_skipped": "known stories skipped",
+    "unchanged_tasks_skipped": "unchanged tasks skipped",
+    "changes_applied": "task changes applied without fetching the task",
+    "throttled_seconds": "seconds spent throttled by rate limits",
+}
+
+
+class MaxDurationReached(Exception):
+    """Raised to stop a run at a checkpoint once its maximum duration has passed."""
+
 
 class Command(BaseCommand):
     """Sync data from Asana to the database"""
 
     help = "Import data from Asana and insert/update model instances"
     commit = True
-    client = None
+    concurrency = DEFAULT_CONCURRENCY
+    deadline = None
+    engine = "sync"
+    flush_size = DEFAULT_FLUSH_SIZE
+    full = False
+    identity_map = None
+    jobs = 1
     process_archived = False
-    synced_ids = []  # A running list of remote ids of tasks that have been synced.
+    refresh_immutable = False
+    resume = False
+    synced_ids = None  # The remote ids of tasks synced in the current run.
+    _checkpoint = None
+    _client = None
+    _owns_client = False
+    _worker_clients = ()
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.synced_ids = set()
+
+    @property
+    def client(self):
+        """The client for the current thread.
+
+        Project workers each get their own client (and so their own http session)
+        unless a client was provided from outside, as when mocked.
+        """
+        return getattr(self._local, "client", None) or self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def writer(self):
+        """The BulkWriter for the current thread."""
+        if not hasattr(self._local, "writer"):
+            self._local.writer = BulkWriter(
+                self.flush_size, identity_map=self.identity_map
+            )
+        return self._local.writer
 
     @staticmethod
     def get_client():
         return client_connect()
 
+    def get_async_fetcher(self):
+        return AsyncFetcher(
+            self.client,
+            concurrency=self.concurrency,
+            rate_limiter=getattr(self.client, "rate_limiter", None),
+            retry_policy=getattr(self.client, "retry_policy", None),
+            circuit_breaker=getattr(self.client, "circuit_breaker", None),
+        )
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--noinput",
@@ -101,6 +187,67 @@ class Command(BaseCommand):
             default=True,
             help="Will not commit changes to the database.",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="Sync this many projects concurrently, each in its own thread. "
+            "By default projects are synced one at a time.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            dest="full",
+            default=False,
+            help="List all tasks of each project, deleting local tasks no longer in "
+            "Asana. By default only tasks modified since the last sync are listed, "
+            "with a full listing every DJASANA_FULL_SYNC_DAYS days.",
+        )
+        parser.add_argument(
+            "--refresh-immutable",
+            action="store_true",
+            dest="refresh_immutable",
+            default=False,
+            help="Fetch and update stories and attachments that have already been "
+            "synced. By default they are treated as unchanging and skipped.",
+        )
+        parser.add_argument(
+            "--engine",
+            choices=["sync", "async"],
+            default="sync",
+            help="With async, the tasks of a project and their subtasks, attachments "
+            "and stories are fetched concurrently with asyncio, then saved in "
+            "batches. Requires httpx.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help="The maximum number of requests in flight at once "
+            "for the async engine.",
+        )
+        parser.add_argument(
+            "--flush-size",
+            type=int,
+            default=DEFAULT_FLUSH_SIZE,
+            help="Write synced objects to the database in batches of this many.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            dest="resume",
+            default=False,
+            help="Resume an interrupted run from its last checkpoint, skipping the "
+            "projects it completed.",
+        )
+        parser.add_argument(
+            "--max-duration",
+            type=int,
+            default=None,
+            help="Stop at a checkpoint once this many seconds have passed. "
+            "Use --resume to continue.",
+        )
 
     def handle(self, *args, **options):
         self.commit = not options.get("nocommit")
@@ -113,6 +260,21 @@ class Command(BaseCommand):
                 self.stdout.write("No action taken.")
                 return
         self.process_archived = options.get("archive")
+        self.refresh_immutable = options.get("refresh_immutable", False)
+        self.full = options.get("full", False)
+        self.jobs = max(options.get("jobs") or 1, 1)
+        self.engine = options.get("engine") or "sync"
+        self.concurrency = max(options.get("concurrency") or DEFAULT_CONCURRENCY, 1)
+        self.flush_size = max(options.get("flush_size") or DEFAULT_FLUSH_SIZE, 1)
+        self.resume = options.get("resume", False)
+        max_duration = options.get("max_duration")
+        self.deadline = time.monotonic() + max_duration if max_duration else None
+        self.counts = Counter()
+        self._local = threading.local()
+        self.identity_map = IdentityMap()
+        self.synced_ids = set()
+        self._checkpoint = None
+        self._worker_clients = []
         models = self._get_models(options)
         if options.get("verbosity", 0) >= 1:
             message = "Synchronizing data from Asana."
@@ -122,12 +284,36 @@ class Command(BaseCommand):
         if settings.ASANA_WORKSPACE:
             workspaces.append(settings.ASANA_WORKSPACE)
         # Allow client to be mocked:
+        self._owns_client = self._client is None
         self.client = self.client or self.get_client()
         workspace_ids = self._get_workspace_ids(workspaces)
         projects = options.get("project")
 
-        for workspace_id in workspace_ids:
-            self._sync_workspace_id(workspace_id, projects, models)
+        try:
+            for workspace_id in workspace_ids:
+                self._sync_workspace_id(workspace_id, projects, models)
+        except MaxDurationReached:
+            message = (
+                "Stopped at a checkpoint after the maximum duration. "
+                "Run with --resume to continue."
+            )
+            self._write(message, self.style.WARNING)
+            logger.info(message)
+        except CircuitOpenError as error:
+            self.writer.flush()
+            message = (
+                f"Stopped at a checkpoint: {error}. "
+                "Run with --resume to continue once it recovers."
+            )
+            self._write(message, self.style.WARNING)
+            logger.warning(message)
+        if self._owns_client:
+            for client in [self._client] + self._worker_clients:
+                self._count(
+                    "throttled_seconds", getattr(client, "throttled_seconds", 0)
+                )
+        if options.get("verbosity", 0) >= 1:
+            self._write_summary()
 
     @staticmethod
     def _confirm():
@@ -274,6 +460,9 @@ class Command(BaseCommand):
                 if Task in models:
                     if event["action"] == "removed":
                         Task.objects.get(remote_id=event["resource"]["gid"]).delete()
+                        self.identity_map.discard(Task, [event["resource"]["gid"]])
+                    elif self.commit and apply_change(event):
+                        self._count("changes_applied")
                     else:
                         self._sync_task(event["resource"], project, models)
                 else:
@@ -283,6 +472,7 @@ class Command(BaseCommand):
                     self._sync_story(event["resource"])
                 else:
                     ignored_tasks += 1
+        self.writer.flush()
         tasks_done = len(events["data"]) - ignored_tasks
         if self.commit:
             message = "Successfully synced {0} events for project {1}.".format(
@@ -292,7 +482,7 @@ class Command(BaseCommand):
                 message += " {0} events ignored for excluded models.".format(
                     ignored_tasks
                 )
-            self.stdout.write(self.style.SUCCESS(message))
+            self._write(message, self.style.SUCCESS)
             logger.info(message)
 
     def _sync_project_id(self, project_id, models):
@@ -301,54 +491,400 @@ class Command(BaseCommand):
         logger.debug("Sync project %s", project_dict["name"])
         logger.debug(project_dict)
         if self.commit:
-            project = sync_project(self.client, project_dict)
+            project = sync_project(self.client, project_dict, writer=self.writer)
 
         if Task in models and not project_dict["archived"] or self.process_archived:
-            for task in self.client.tasks.find_all({"project": project_id}):
-                self._sync_task(task, project, models)
-            # Delete local tasks for this project that are no longer in Asana.
-            tasks_to_delete = (
-                Task.objects.filter(projects=project)
-                .exclude(remote_id__in=self.synced_ids)
-                .exclude(remote_id__isnull=True)
-            )
-            if tasks_to_delete.count() > 0:
-                id_list = list(tasks_to_delete.values_list("remote_id", flat=True))
-                tasks_to_delete.delete()
-                message = "Deleted {} tasks no longer present: {}".format(
-                    len(id_list), id_list
+            offset, last_task_id, started_at = self._get_resume_point(project_id)
+            # Tasks synced before the run was interrupted are not in synced_ids.
+            resumed = started_at is not None
+            started_at = started_at or timezone.now()
+            modified_since = self._get_modified_since(project_id)
+            query = {"project": project_id}
+            if modified_since:
+                logger.debug("Listing tasks modified since %s", modified_since)
+                query["modified_since"] = modified_since.isoformat()
+            if self.engine == "async":
+                with self.get_async_fetcher() as fetcher:
+                    try:
+                        self._sync_task_pages(
+                            query,
+                            project,
+                            models,
+                            offset,
+                            last_task_id,
+                            started_at,
+                            fetcher,
+                        )
+                    finally:
+                        self._count("throttled_seconds", fetcher.throttled_seconds)
+            else:
+                self._sync_task_pages(
+                    query, project, models, offset, last_task_id, started_at
+                )
+            self.writer.flush()
+            if not (modified_since or resumed):
+                # Delete local tasks for this project that are no longer in Asana.
+                local_ids = Task.objects.filter(
+                    projects=project, remote_id__isnull=False
+                ).values_list("remote_id", flat=True)
+                id_list = sorted(set(local_ids) - self.synced_ids)
+                if id_list:
+                    Task.objects.filter(remote_id__in=id_list).delete()
+                    self.identity_map.discard(Task, id_list)
+                    message = "Deleted {} tasks no longer present: {}".format(
+                        len(id_list), id_list
+                    )
+                    self._write(message, self.style.SUCCESS)
+                    logger.info(message)
+            if self.commit:
+                defaults = {"synced_at": started_at}
+                if not (modified_since or resumed):
+                    defaults["full_synced_at"] = started_at
+                ProjectSync.objects.update_or_create(
+                    project_id=project_id, defaults=defaults
                 )
-                self.stdout.write(self.style.SUCCESS(message))
-                logger.info(message)
         if self.commit:
             message = f"Successfully synced project {project.name}."
-            self.stdout.write(self.style.SUCCESS(message))
+            self._write(message, self.style.SUCCESS)
             logger.info(message)
         return project_dict["archived"]
 
-    def _sync_story(self, story):
-        story_id = story.get("gid")
+    def _get_modified_since(self, project_id):
+        """Returns when the last sync of this project's tasks started, if only
+        tasks modified since then need to be listed, else None.
+
+        All tasks are listed if asked for, if the project has not been synced,
+        or if it has not been fully synced within DJASANA_FULL_SYNC_DAYS.
+        """
+        if self.full:
+            return None
+        project_sync = ProjectSync.objects.filter(project_id=project_id).first()
+        if not (
+            project_sync and project_sync.synced_at and project_sync.full_synced_at
+        ):
+            return None
+        full_sync_due = project_sync.full_synced_at + timedelta(
+            days=settings.DJASANA_FULL_SYNC_DAYS
+        )
+        if full_sync_due <= timezone.now():
+            return None
+        return project_sync.synced_at
+
+    def _list_task_pages(self, query, offset=None):
+        """Yields each page of the tasks listed by the query, starting from the
+        offset, with the offset it was listed from."""
+        while True:
+            options = {
+                "fields": TASK_FIELDS,
+                "full_payload": True,
+                "iterator_type": None,
+                "limit": self.client.options.get("page_size", 50),
+            }
+            if offset:
+                options["offset"] = offset
+            response = self.client.tasks.find_all(query, **options)
+            yield response["data"], offset
+            next_page = response.get("next_page")
+            if not next_page:
+                return
+            offset = next_page["offset"]
+
+    def _sync_task_pages(
+        self, query, project, models, offset, last_task_id, started_at, fetcher=None
+    ):
+        """Sync the tasks listed by the query page by page, checkpointing each page.
+
+        Tasks of the first page up to and including last_task_id are skipped,
+        having been synced before the run was interrupted.
+        """
+        for tasks, offset in self._list_task_pages(query, offset):
+            if last_task_id:
+                task_ids = [int(task["gid"]) for task in tasks]
+                if last_task_id in task_ids:
+                    tasks = tasks[task_ids.index(last_task_id) + 1 :]
+                last_task_id = None
+            if self._checkpoint and self.jobs == 1:
+                self.writer.flush()
+                self._save_checkpoint(
+                    project_remote_id=project.remote_id,
+                    project_started_at=started_at,
+                    offset=offset,
+                    task_remote_id=None,
+                )
+            if fetcher:
+                self._sync_tasks_async(tasks, project, models, fetcher)
+            else:
+                for task in tasks:
+                    self._sync_task(task, project, models)
+                    self._stop_if_out_of_time(task["gid"])
+
+    def _sync_tasks_async(self, tasks, project, models, fetcher):
+        """Sync tasks with the async engine.
+
+        For each batch of tasks, the tasks with their subtasks, attachments and
+        stories are fetched concurrently, then saved in one transaction.
+        """
+        batch_size = self.concurrency * ASYNC_BATCH_FACTOR
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start : start + batch_size]
+            task_ids = [task["gid"] for task in batch]
+            self._local.prefetched = fetcher.fetch_tasks(
+                batch,
+                attachments=Attachment in models and self.commit,
+                stories=Story in models and self.commit,
+                skip_ids={
+                    str(remote_id)
+                    for remote_id in self._get_known_attachment_ids(task_ids)
+                    | self._get_known_story_ids(task_ids)
+                },
+            )
+            try:
+                with transaction.atomic():
+                    for task in batch:
+                        self._sync_task(task, project, models)
+                    self.writer.flush()
+            finally:
+                self._local.prefetched = {}
+            self._stop_if_out_of_time(task_ids[-1])
+
+    def _load_checkpoint(self, workspace_id):
+        """Loads the checkpoint of an interrupted run of this workspace if
+        resuming, else starts a new one."""
+        checkpoint = None
+        if self.resume:
+            checkpoint = SyncCheckpoint.objects.filter(
+                workspace_remote_id=workspace_id
+            ).first()
+        if checkpoint:
+            message = (
+                "Resuming sync of workspace {}; {} projects already synced.".format(
+                    workspace_id, len(checkpoint.completed_project_ids)
+                )
+            )
+            self._write(message)
+            logger.info(message)
+        else:
+            SyncCheckpoint.objects.filter(workspace_remote_id=workspace_id).delete()
+            checkpoint = SyncCheckpoint.objects.create(workspace_remote_id=workspace_id)
+        self._checkpoint = checkpoint
+
+    def _save_checkpoint(self, **fields):
+        if self._checkpoint is None:
+            return
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self._checkpoint, name, value)
+            self._checkpoint.save()
+
+    def _get_resume_point(self, project_id):
+        """Returns the offset, last task id and start time of the sync of this
+        project's tasks that was interrupted, else Nones."""
+        checkpoint = self._checkpoint
+        if checkpoint is None or checkpoint.project_remote_id != int(project_id):
+            return None, None, None
+        return (
+            checkpoint.offset,
+            checkpoint.task_remote_id,
+            checkpoint.project_started_at,
+        )
+
+    def _complete_project(self, project_id):
+        if self._checkpoint is None:
+            return
+        with self._lock:
+            completed_project_ids = self._checkpoint.completed_project_ids
+        self._save_checkpoint(
+            completed_project_ids=completed_project_ids + [int(project_id)],
+            project_remote_id=None,
+            project_started_at=None,
+            offset=None,
+            task_remote_id=None,
+        )
+
+    def _stop_if_out_of_time(self, task_id=None):
+        """Stops the run at a checkpoint if its maximum duration has passed."""
+        if self.deadline is None or time.monotonic() < self.deadline:
+            return
+        self.writer.flush()
+        if task_id is not None and self.jobs == 1:
+            self._save_checkpoint(task_remote_id=task_id)
+        raise MaxDurationReached()
+
+    def _fetch(self, kind, remote_id, fetch):
+        """Returns the result prefetched by the async engine if there is one,
+        else the result of calling fetch."""
+        prefetched = getattr(self._local, "prefetched", None)
+        result = prefetched.pop((kind, remote_id), None) if prefetched else None
+        if result is None:
+            return fetch()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _fetch_many(self, kind, resource, remote_ids):
+        """Returns the results prefetched by the async engine for the remote ids,
+        fetching the others from the resource with find_by_ids."""
+        prefetched = getattr(self._local, "prefetched", None) or {}
+        results = {
+            remote_id: prefetched.pop((kind, remote_id), None)
+            for remote_id in remote_ids
+        }
+        missing_ids = [
+            remote_id for remote_id, result in results.items() if result is None
+        ]
+        results.update(
+            zip(missing_ids, find_by_ids(self.client, resource, missing_ids))
+        )
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+        return [results[remote_id] for remote_id in remote_ids]
+
+    def _sync_project_ids_concurrently(self, project_ids, workspace, models):
+        """Sync projects in a bounded pool of threads.
+
+        A failure in one project is reported and does not stop the others;
+        a CommandError listing the failed projects is raised once all are done.
+        """
+        failed_ids = []
+        stopped = None
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="sync_from_asana"
+        ) as executor:
+            futures = {
+                executor.submit(
+                    self._sync_project_id_in_worker, project_id, workspace, models
+                ): project_id
+                for project_id in project_ids
+            }
+            for future in as_completed(futures):
+                project_id = futures[future]
+                error = future.exception()
+                if isinstance(error, (MaxDurationReached, CircuitOpenError)):
+                    stopped = error
+                elif error:
+                    failed_ids.append(project_id)
+                    message = f"Failed to sync project {project_id}: {error!r}"
+                    self._write(message, self.style.ERROR)
+                    logger.error(message, exc_info=error)
+                else:
+                    self._complete_project(project_id)
+        if failed_ids:
+            raise CommandError(
+                f"Failed to sync {len(failed_ids)} projects: "
+                f"{', '.join(str(id_) for id_ in failed_ids)}"
+            )
+        if stopped:
+            raise stopped
+
+    def _sync_project_id_in_worker(self, project_id, workspace, models):
+        """Sync one project from a worker thread with its own client and
+        database connection."""
+        if self._owns_client and not hasattr(self._local, "client"):
+            client = self.get_client()
+            client.options.update(self._client.options)
+            self._local.client = client
+            with self._lock:
+                self._worker_clients.append(client)
         try:
-            story_dict = self.client.stories.find_by_id(story_id)
+            self._stop_if_out_of_time()
+            self._check_sync_project_id(project_id, workspace, models)
+        finally:
+            connections.close_all()
+
+    def _count(self, key, number=1):
+        """Adds to a count reported in the summary at the end of the run."""
+        with self._lock:
+            self.counts[key] += number
+
+    def _write_summary(self):
+        for key, label in COUNT_LABELS.items():
+            if self.counts[key]:
+                count = self.counts[key]
+                if isinstance(count, float):
+                    count = round(count, 1)
+                message = f"{count} {label}."
+                self._write(message)
+                logger.info(message)
+
+    def _write(self, message, style_func=None):
+        """Writes a message to stdout without interleaving output across threads."""
+        with self._lock:
+            self.stdout.write(style_func(message) if style_func else message)
+
+    def _fetch_story(self, story_id):
+        """Returns the story dict, or None if the story is no longer in Asana."""
+        try:
+            story_dict = self._fetch(
+                "story", story_id, lambda: self.client.stories.find_by_id(story_id)
+            )
         except NotFoundError as error:
             logger.info(error.response)
-            return
+            return None
         logger.debug(story_dict)
-        remote_id = story_dict["gid"]
-        sync_story(remote_id, story_dict)
+        return story_dict
+
+    def _sync_story(self, story):
+        story_dict = self._fetch_story(story.get("gid"))
+        if story_dict:
+            sync_story(story_dict["gid"], story_dict, writer=self.writer)
 
-    def _sync_tag(self, tag, workspace):
-        tag_dict = self.client.tags.find_by_id(tag["gid"])
+    def _get_known_attachment_ids(self, task_ids):
+        """Returns the remote ids of attachments already synced for these tasks,
+        which need not be synced again unless refreshing immutable objects."""
+        if self.refresh_immutable:
+            return set()
+        return set(
+            Attachment.objects.filter(parent_id__in=task_ids).values_list(
+                "remote_id", flat=True
+            )
+        )
+
+    def _get_known_story_ids(self, task_ids):
+        """Returns the remote ids of stories already synced for these tasks,
+        which need not be synced again unless refreshing immutable objects."""
+        if self.refresh_immutable:
+            return set()
+        return set(
+            Story.objects.filter(target__in=task_ids).values_list(
+                "remote_id", flat=True
+            )
+        )
+
+    def _sync_stories(self, stories, task_id):
+        """Sync a task's stories in one batch.
+
+        Stories already synced are skipped, and stories listed with all of
+        STORY_FIELDS are not fetched again.
+        """
+        known_ids = self._get_known_story_ids([task_id])
+        story_dicts = []
+        for story in stories:
+            if int(story["gid"]) in known_ids:
+                self._count("known_stories_skipped")
+            elif has_fields(story, STORY_FIELDS):
+                story_dicts.append(story)
+            else:
+                story_dict = self._fetch_story(story["gid"])
+                if story_dict:
+                    story_dicts.append(story_dict)
+        sync_stories(story_dicts, update=self.refresh_immutable, writer=self.writer)
+
+    def _sync_tag(self, tag_dict, workspace):
         logger.debug(tag_dict)
         if self.commit:
             remote_id = tag_dict["gid"]
             tag_dict["workspace"] = workspace
             followers_dict = tag_dict.pop("followers")
             pop_unsupported_fields(tag_dict, Tag)
-            tag = Tag.objects.get_or_create(remote_id=remote_id, defaults=tag_dict)[0]
-            follower_ids = [follower["gid"] for follower in followers_dict]
-            followers = User.objects.filter(id__in=follower_ids)
-            tag.followers.set(followers)
+            tag_dict["remote_id"] = remote_id
+            self.writer.add(Tag, tag_dict)
+            self.writer.set_related(
+                Tag,
+                remote_id,
+                "followers",
+                [follower["gid"] for follower in followers_dict],
+            )
 
     def _sync_task(self, task, project, models, skip_subtasks=False):
         """Sync this task and its parent, dependencies, and subtasks
@@ -357,16 +893,26 @@ class Command(BaseCommand):
         so skip_subtasks True is passed when syncing a parent task from a subtask.
         """
         task_id = task["gid"]
-        try:
-            task_dict = self.client.tasks.find_by_id(task_id)
-        except (ForbiddenError, NotFoundError):
+        if has_fields(task, TASK_FIELDS):
+            # This task was listed with all the fields we need.
+            task_dict = task
+        else:
             try:
-                Task.objects.get(remote_id=task_id).delete()
-            except Task.DoesNotExist:
-                pass
-            return
+                task_dict = self._fetch(
+                    "task",
+                    task_id,
+                    lambda: self.client.tasks.find_by_id(task_id, fields=TASK_FIELDS),
+                )
+            except (ForbiddenError, NotFoundError):
+                try:
+                    Task.objects.get(remote_id=task_id).delete()
+                except Task.DoesNotExist:
+                    pass
+                self.identity_map.discard(Task, [task_id])
+                return
         logger.debug("Sync task %s", task_dict["name"])
         logger.debug(task_dict)
+        num_subtasks = task_dict.get("num_subtasks")
 
         if Task in models and self.commit:
             remote_id = task_dict["gid"]
@@ -375,37 +921,83 @@ class Command(BaseCommand):
             if parent:
                 # If this is a task we already know about, assume it was just synced.
                 parent_id = parent["gid"]
-                if (
-                    parent_id not in self.synced_ids
-                    and not Task.objects.filter(remote_id=parent_id).exists()
+                if int(parent_id) not in self.synced_ids and not self.identity_map.has(
+                    Task, parent_id
                 ):
                     self._sync_task(parent, project, models, skip_subtasks=True)
                 task_dict["parent_id"] = parent_id
-            task_ = sync_task(remote_id, task_dict, project, sync_tags=Tag in models)
-            self.synced_ids.append(remote_id)
+            task_ = get_unchanged_task(remote_id, task_dict, project)
+            if task_:
+                self._count("unchanged_tasks_skipped")
+            else:
+                sync_task(
+                    remote_id,
+                    task_dict,
+                    project,
+                    sync_tags=Tag in models,
+                    skip_unchanged=False,
+                    writer=self.writer,
+                )
+            with self._lock:
+                self.synced_ids.add(int(remote_id))
             if not skip_subtasks:
-                for subtask in self.client.tasks.subtasks(task_id):
-                    if subtask["gid"] not in self.synced_ids:
+                if num_subtasks == 0:
+                    subtasks = []
+                    self._count("subtask_requests_avoided")
+                else:
+                    subtasks = self._fetch(
+                        "subtasks",
+                        task_id,
+                        lambda: self.client.tasks.subtasks(task_id, fields=TASK_FIELDS),
+                    )
+                for subtask in subtasks:
+                    if int(subtask["gid"]) not in self.synced_ids:
                         self._sync_task(subtask, project, models)
                 if dependencies:
                     for subtask in dependencies:
-                        if subtask["gid"] not in self.synced_ids:
+                        if int(subtask["gid"]) not in self.synced_ids:
                             self._sync_task(subtask, project, models)
-                    task_.dependencies.set(
-                        Task.objects.filter(
-                            remote_id__in=[dep["gid"] for dep in dependencies]
-                        )
+                    self.writer.set_related(
+                        Task,
+                        remote_id,
+                        "dependencies",
+                        [dep["gid"] for dep in dependencies],
                     )
         if Attachment in models and self.commit:
-            for attachment in self.client.attachments.find_by_task(task_id):
-                sync_attachment(self.client, task_, attachment["gid"])
+            attachments = self._fetch(
+                "attachments",
+                task_id,
+                lambda: self.client.attachments.find_by_task(task_id),
+            )
+            known_ids = self._get_known_attachment_ids([task_id])
+            attachment_ids = []
+            for attachment in attachments:
+                if int(attachment["gid"]) in known_ids:
+                    self._count("known_attachments_skipped")
+                else:
+                    attachment_ids.append(attachment["gid"])
+            attachment_dicts = self._fetch_many(
+                "attachment", "attachments", attachment_ids
+            )
+            for attachment_id, attachment_dict in zip(attachment_ids, attachment_dicts):
+                sync_attachment(
+                    self.client,
+                    Task(remote_id=task_id),
+                    attachment_id,
+                    attachment_dict,
+                    update=self.refresh_immutable,
+                    writer=self.writer,
+                )
         if Story in models and self.commit:
-            for story in self.client.stories.find_by_task(task_id):
-                self._sync_story(story)
+            stories = self._fetch(
+                "stories",
+                task_id,
+                lambda: self.client.stories.find_by_task(task_id, fields=STORY_FIELDS),
+            )
+            self._sync_stories(stories, task_id)
         return
 
-    def _sync_team(self, team):
-        team_dict = self.client.teams.find_by_id(team["gid"])
+    def _sync_team(self, team_dict):
         logger.debug(team_dict)
         if self.commit:
             remote_id = team_dict["gid"]
@@ -413,21 +1005,29 @@ class Command(BaseCommand):
             team_dict["organization_id"] = organization["gid"]
             team_dict["organization_name"] = organization["name"]
             pop_unsupported_fields(team_dict, Team)
-            Team.objects.get_or_create(remote_id=remote_id, defaults=team_dict)
+            team_dict["remote_id"] = remote_id
+            self.writer.add(Team, team_dict)
 
-    def _sync_user(self, user, workspace):
-        user_dict = self.client.users.find_by_id(user["gid"])
+    def _sync_user(self, user_dict, workspace):
         logger.debug(user_dict)
         if self.commit:
             remote_id = user_dict["gid"]
             user_dict.pop("workspaces")
             if user_dict["photo"]:
                 user_dict["photo"] = user_dict["photo"]["image_128x128"]
-            user = User.objects.update_or_create(
-                remote_id=remote_id, defaults=user_dict
-            )[0]
+            pop_unsupported_fields(user_dict, User)
+            user_dict["remote_id"] = remote_id
+            self.writer.add(User, user_dict)
             if workspace:
-                user.workspaces.add(workspace)
+                self.writer.set_related(
+                    User, remote_id, "workspaces", [workspace.remote_id], clear=False
+                )
+
+    def _preload_identity_map(self):
+        """Loads the remote ids of users, tags and tasks already in the database,
+        so references to them need not be looked up one at a time."""
+        for model in (User, Tag, Task):
+            self.identity_map.preload(model)
 
     def _sync_workspace_id(self, workspace_id, projects, models):
         workspace_dict = self.client.workspaces.find_by_id(workspace_id)
@@ -441,7 +1041,16 @@ class Command(BaseCommand):
             )[0]
         else:
             workspace = None
+        if self.commit:
+            self._preload_identity_map()
+            self._load_checkpoint(workspace_id)
         project_ids = self._get_project_ids(projects, workspace_id)
+        if self._checkpoint and self._checkpoint.completed_project_ids:
+            project_ids = [
+                project_id
+                for project_id in project_ids
+                if int(project_id) not in self._checkpoint.completed_project_ids
+            ]
         if (
             "workspace_id" in self.client.options
             and workspace_id != self.client.options["workspace_id"]
@@ -449,22 +1058,43 @@ class Command(BaseCommand):
             self.client.options["workspace_id"] = str(workspace_id)
 
         if User in models:
-            for user in self.client.users.find_all({"workspace": workspace_id}):
-                self._sync_user(user, workspace)
+            users = self.client.users.find_all({"workspace": workspace_id})
+            for user_dict in find_by_ids(
+                self.client, "users", (user["gid"] for user in users)
+            ):
+                self._sync_user(user_dict, workspace)
+            self.writer.flush()
 
         if Tag in models:
-            for tag in self.client.tags.find_by_workspace(workspace_id):
-                self._sync_tag(tag, workspace)
+            tags = self.client.tags.find_by_workspace(workspace_id)
+            for tag_dict in find_by_ids(
+                self.client, "tags", (tag["gid"] for tag in tags)
+            ):
+                self._sync_tag(tag_dict, workspace)
+            self.writer.flush()
 
         if Team in models:
-            for team in self.client.teams.find_by_organization(workspace_id):
-                self._sync_team(team)
+            teams = self.client.teams.find_by_organization(workspace_id)
+            for team_dict in find_by_ids(
+                self.client, "teams", (team["gid"] for team in teams)
+            ):
+                self._sync_team(team_dict)
+            self.writer.flush()
 
         if Project in models:
-            for project_id in project_ids:
-                self._check_sync_project_id(project_id, workspace, models)
+            if self.jobs > 1:
+                self._sync_project_ids_concurrently(project_ids, workspace, models)
+            else:
+                for project_id in project_ids:
+                    self._stop_if_out_of_time()
+                    self._check_sync_project_id(project_id, workspace, models)
+                    self._complete_project(project_id)
 
+        if self._checkpoint:
+            # The run got through the workspace, so there is nothing to resume.
+            self._checkpoint.delete()
+            self._checkpoint = None
         if workspace:
             message = f"Successfully synced workspace {workspace.name}."
-            self.stdout.write(self.style.SUCCESS(message))
+            self._write(message, self.style.SUCCESS)
             logger.info(message)
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djasana", "0024_adds_custom_field_created_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProjectSync",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "synced_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the last sync of this project's tasks started.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "full_synced_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the last sync that listed all of this "
+                        "project's tasks, deleting those no longer in Asana, started.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "project",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="djasana.project",
+                        to_field="remote_id",
+                    ),
+                ),
+            ],
+        ),
+    ]
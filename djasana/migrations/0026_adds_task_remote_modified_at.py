@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djasana", "0025_adds_project_sync"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="remote_modified_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When this task was last modified in Asana, "
+                "as of its last sync.",
+                null=True,
+            ),
+        ),
+    ]
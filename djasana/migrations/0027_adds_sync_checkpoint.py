@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djasana", "0026_adds_task_remote_modified_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "workspace_remote_id",
+                    models.BigIntegerField(
+                        help_text="The id of the workspace in Asana.", unique=True
+                    ),
+                ),
+                (
+                    "completed_project_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="The Asana ids of the projects this run has synced.",
+                    ),
+                ),
+                (
+                    "project_remote_id",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="The Asana id of the project being synced.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "project_started_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the sync of the tasks of the project being "
+                        "synced started.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "offset",
+                    models.CharField(
+                        blank=True,
+                        help_text="The pagination offset of the page of tasks being "
+                        "synced.",
+                        max_length=1024,
+                        null=True,
+                    ),
+                ),
+                (
+                    "task_remote_id",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="The Asana id of the last task synced from that page.",
+                        null=True,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djasana", "0027_adds_sync_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "project_remote_id",
+                    models.BigIntegerField(
+                        db_index=True,
+                        help_text="The Asana id of the project of the webhook.",
+                    ),
+                ),
+                (
+                    "payload",
+                    models.JSONField(help_text="The event as delivered by Asana."),
+                ),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "process_after",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="When the event is next to be processed.",
+                    ),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(
+                        default=0,
+                        help_text="How many times processing the event has failed.",
+                    ),
+                ),
+                (
+                    "error",
+                    models.TextField(
+                        blank=True, help_text="The error of the last failed attempt."
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("id",),
+            },
+        ),
+    ]
@@ -4,9 +4,10 @@ import logging
 from django.core.cache import cache
 from django.core.validators import MinLengthValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from .connect import client_connect
+from .connect import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -227,6 +228,27 @@ class Project(NamedModel):
         return f"{ASANA_BASE_URL}{self.remote_id}/list"
 
 
+class ProjectSync(models.Model):
+    """When the tasks of a project were last synced from Asana"""
+
+    project = models.OneToOneField(
+        "Project", to_field="remote_id", on_delete=models.CASCADE
+    )
+    synced_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text=_("When the last sync of this project's tasks started."),
+    )
+    full_synced_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text=_(
+            "When the last sync that listed all of this project's tasks, "
+            "deleting those no longer in Asana, started."
+        ),
+    )
+
+
 class ProjectStatus(BaseModel):
     """An update on the progress of a project."""
 
@@ -335,6 +357,41 @@ class Story(Hearted, NamedModel):
         verbose_name_plural = "stories"
 
 
+class SyncCheckpoint(models.Model):
+    """How far a run of sync_from_asana got through a workspace, for resuming it"""
+
+    workspace_remote_id = models.BigIntegerField(
+        unique=True, help_text=_("The id of the workspace in Asana.")
+    )
+    completed_project_ids = models.JSONField(
+        default=list,
+        blank=True,
+        help_text=_("The Asana ids of the projects this run has synced."),
+    )
+    project_remote_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text=_("The Asana id of the project being synced."),
+    )
+    project_started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text=_("When the sync of the tasks of the project being synced started."),
+    )
+    offset = models.CharField(
+        max_length=1024,
+        null=True,
+        blank=True,
+        help_text=_("The pagination offset of the page of tasks being synced."),
+    )
+    task_remote_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text=_("The Asana id of the last task synced from that page."),
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class SyncToken(models.Model):
     """The most recent sync token received from Asana for the project"""
 
@@ -400,6 +457,11 @@ class Task(Hearted, NamedModel):
     html_notes = models.TextField(null=True, blank=True)
     modified_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(null=True, blank=True)
+    remote_modified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text=_("When this task was last modified in Asana, as of its last sync."),
+    )
     parent = models.ForeignKey(
         "self", to_field="remote_id", null=True, blank=True, on_delete=models.SET_NULL
     )
@@ -428,7 +490,7 @@ class Task(Hearted, NamedModel):
 
     def delete_from_asana(self, *args, **kwargs):
         """Deletes this task from Asana and then deletes this model instance."""
-        client = client_connect()
+        client = get_client()
         client.tasks.delete(self.remote_id)
         logger.debug("Deleted asana task %s", self.name)
         return self.delete(*args, **kwargs)
@@ -440,7 +502,7 @@ class Task(Hearted, NamedModel):
 
     def refresh_from_asana(self):
         """Updates this task from Asana."""
-        client = client_connect()
+        client = get_client()
         task_dict = client.tasks.find_by_id(self.remote_id)
         if task_dict["assignee"]:
             user = User.objects.get_or_create(
@@ -461,7 +523,7 @@ class Task(Hearted, NamedModel):
             setattr(self, field, value)
         self.save()
         follower_ids = [follower["gid"] for follower in followers_dict]
-        followers = User.objects.filter(id__in=follower_ids)
+        followers = User.objects.filter(remote_id__in=follower_ids)
         self.followers.set(followers)
         for tag_ in tags_dict:
             tag = Tag.objects.get_or_create(
@@ -469,7 +531,9 @@ class Task(Hearted, NamedModel):
             )[0]
             self.tags.add(tag)
         if dependencies:
-            self.dependencies.set([dep["gid"] for dep in dependencies])
+            self.dependencies.set(
+                Task.objects.filter(remote_id__in=[dep["gid"] for dep in dependencies])
+            )
 
     def sync_to_asana(self, fields=None):
         """Updates Asana to match values from this task.
@@ -489,13 +553,13 @@ class Task(Hearted, NamedModel):
         """
         fields = fields or ["completed"]
         data = {field: getattr(self, field) for field in fields}
-        client = client_connect()
+        client = get_client()
         client.tasks.update(self.remote_id, data)
         logger.debug("Updated asana for task %s", self.name)
 
     def add_comment(self, text):
         """Adds a comment in Asana for this task."""
-        client = client_connect()
+        client = get_client()
         response = client.tasks.add_comment(self.remote_id, {"text": text})
         logger.debug("Added comment for task %s: %s", self.name, text)
         return response
@@ -551,7 +615,7 @@ class User(NamedModel):
     workspaces = models.ManyToManyField("Workspace")
 
     def refresh_from_asana(self):
-        client = client_connect()
+        client = get_client()
         user_dict = client.users.find_by_id(self.remote_id)
         user_dict.pop("gid", None)
         user_dict.pop("workspaces")
@@ -574,6 +638,38 @@ class Webhook(models.Model):
     )
 
 
+class WebhookEvent(models.Model):
+    """An event delivered to a webhook, kept until process_asana_events applies it"""
+
+    project_remote_id = models.BigIntegerField(
+        db_index=True,
+        help_text=_("The Asana id of the project of the webhook."),
+    )
+    payload = models.JSONField(help_text=_("The event as delivered by Asana."))
+    received_at = models.DateTimeField(auto_now_add=True)
+    process_after = models.DateTimeField(
+        default=timezone.now,
+        help_text=_("When the event is next to be processed."),
+    )
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveSmallIntegerField(
+        default=0, help_text=_("How many times processing the event has failed.")
+    )
+    error = models.TextField(
+        blank=True, help_text=_("The error of the last failed attempt.")
+    )
+
+    class Meta:
+        ordering = ("id",)
+
+    def __str__(self):
+        return "{} {} {}".format(
+            self.payload.get("action"),
+            self.payload.get("resource", {}).get("resource_type"),
+            self.payload.get("resource", {}).get("gid"),
+        )
+
+
 class Workspace(NamedModel):
     """An object for grouping projects"""
 
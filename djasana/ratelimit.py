@@ -0,0 +1,88 @@
+"""A client-side rate limit for requests to Asana, shared by threads and processes."""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the bucket is then per process.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """A token bucket allowing `rate` requests per minute.
+
+    Its state is kept in a file locked while it is read and written, so every
+    thread and process on the host using the same path shares one bucket. Up to
+    `capacity` requests, by default ten seconds' worth, may be made in a burst.
+    """
+
+    def __init__(self, rate, path, capacity=None):
+        self.rate = rate / 60.0
+        self.capacity = capacity or max(rate / 6.0, 1.0)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def take(self, tokens=1):
+        """Takes the tokens if they are available and returns 0, else returns the
+        number of seconds to wait before trying again.
+
+        More tokens than the capacity may be taken once the bucket is full, leaving
+        it in debt, so that a request counting as many requests waits its turn."""
+        with self._state() as state:
+            now = time.time()
+            if state["blocked_until"] > now:
+                return state["blocked_until"] - now
+            available = min(
+                self.capacity,
+                state["tokens"] + (now - state["updated_at"]) * self.rate,
+            )
+            state["updated_at"] = now
+            needed = min(tokens, self.capacity)
+            if available >= needed:
+                state["tokens"] = available - tokens
+                return 0
+            state["tokens"] = available
+            return (needed - available) / self.rate
+
+    def acquire(self, tokens=1):
+        """Takes the tokens, waiting until they are available. Returns the seconds
+        waited."""
+        waited = 0.0
+        while True:
+            wait = self.take(tokens)
+            if not wait:
+                return waited
+            logger.debug("Rate limited; waiting %.2f seconds", wait)
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, seconds):
+        """Gives out no tokens for this many seconds, as when Asana responds with
+        Retry-After."""
+        with self._state() as state:
+            state["blocked_until"] = max(state["blocked_until"], time.time() + seconds)
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, "a+") as state_file:
+            if fcntl:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            try:
+                state = json.loads(state_file.read())
+            except ValueError:
+                state = {
+                    "tokens": self.capacity,
+                    "updated_at": time.time(),
+                    "blocked_until": 0,
+                }
+            yield state
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(json.dumps(state))
+            state_file.flush()
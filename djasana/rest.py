@@ -0,0 +1,234 @@
+"""A lean client for the Asana REST API, covering the endpoints djasana uses.
+
+Its resources have the methods of the python-asana Client that djasana calls,
+like tasks.find_by_id, so code written for either runs on both.
+"""
+import json
+import logging
+import time
+from functools import partial
+
+import requests
+from asana.client import STATUS_MAP
+from asana.error import RateLimitEnforcedError, ServerError
+
+logger = logging.getLogger(__name__)
+
+# The endpoints of each resource by method name, as (client method, path,
+# default options). Paths take the gids of the objects they are about.
+RESOURCES = {
+    "attachments": {
+        "find_by_id": ("get", "/attachments/%s", {}),
+        "find_by_task": ("get_collection", "/tasks/%s/attachments", {}),
+    },
+    "custom_fields": {
+        "find_by_id": ("get", "/custom_fields/%s", {}),
+    },
+    "events": {
+        "get": ("get", "/events", {"full_payload": True}),
+    },
+    "projects": {
+        "find_all": ("get_collection", "/projects", {}),
+        "find_by_id": ("get", "/projects/%s", {}),
+    },
+    "stories": {
+        "find_by_id": ("get", "/stories/%s", {}),
+        "find_by_task": ("get_collection", "/tasks/%s/stories", {}),
+    },
+    "tags": {
+        "find_by_id": ("get", "/tags/%s", {}),
+        "find_by_workspace": ("get_collection", "/workspaces/%s/tags", {}),
+    },
+    "tasks": {
+        "add_comment": ("post", "/tasks/%s/stories", {}),
+        "delete": ("delete", "/tasks/%s", {}),
+        "find_all": ("get_collection", "/tasks", {}),
+        "find_by_id": ("get", "/tasks/%s", {}),
+        "subtasks": ("get_collection", "/tasks/%s/subtasks", {}),
+        "update": ("put", "/tasks/%s", {}),
+    },
+    "teams": {
+        "find_by_id": ("get", "/teams/%s", {}),
+        "find_by_organization": ("get_collection", "/organizations/%s/teams", {}),
+    },
+    "users": {
+        "find_all": ("get_collection", "/users", {}),
+        "find_by_id": ("get", "/users/%s", {}),
+    },
+    "webhooks": {
+        "create": ("post", "/webhooks", {}),
+        "delete_by_id": ("delete", "/webhooks/%s", {}),
+        "get_all": ("get_collection", "/webhooks", {}),
+    },
+    "workspaces": {
+        "find_all": ("get_collection", "/workspaces", {}),
+        "find_by_id": ("get", "/workspaces/%s", {}),
+    },
+}
+
+# Options given to a request method that are sent as query parameters.
+QUERY_OPTIONS = ("limit", "offset", "sync")
+
+
+def get_error(response):
+    """Returns the python-asana error for a response with an error status, else
+    None.
+
+    Unlike the errors of STATUS_MAP, it only needs the status_code, headers and
+    json() of the response, so it works for those of httpx and of batch actions.
+    A rate limited response without a Retry-After is retried with backoff.
+    """
+    status = response.status_code
+    if 500 <= status < 600:
+        error = ServerError()
+    elif status == 429 and "Retry-After" not in response.headers:
+        error = RateLimitEnforcedError()
+    elif status in STATUS_MAP:
+        return STATUS_MAP[status](response)
+    else:
+        return None
+    error.status = status
+    error.response = response
+    return error
+
+
+class Resource(object):
+    """The endpoints of one resource, called like those of python-asana, as
+    method(*gids, params={}, **options)."""
+
+    def __init__(self, client, endpoints):
+        for name, (method, path, defaults) in endpoints.items():
+            setattr(self, name, partial(self._call, client, method, path, defaults))
+
+    @staticmethod
+    def _call(client, method, path, defaults, *args, **options):
+        count = path.count("%s")
+        params = args[count] if len(args) > count else {}
+        return getattr(client, method)(
+            path % args[:count], params, **dict(defaults, **options)
+        )
+
+
+class RestClient(object):
+    """A client making requests to the Asana REST API.
+
+    Each request is made once; connect.NativeClient adds retries, rate limits and
+    the circuit breaker. Collections are streamed a page of page_size items at a
+    time as they are iterated over. Every method takes fields, the opt_fields
+    of the objects to return.
+
+    Each of request_hooks is called with the method, url and params of each
+    request, and each of response_hooks with the method, url, response and
+    seconds taken, as for metrics.
+    """
+
+    DEFAULT_OPTIONS = {"base_url": "https://app.asana.com/api/1.0", "page_size": 100}
+
+    def __init__(self, session=None, auth=None, **options):
+        self.session = session or requests.Session()
+        self.auth = auth
+        self.headers = options.pop("headers", {})
+        self.options = dict(self.DEFAULT_OPTIONS, **options)
+        self.request_hooks = []
+        self.response_hooks = []
+        for name, endpoints in RESOURCES.items():
+            setattr(self, name, Resource(self, endpoints))
+
+    @classmethod
+    def access_token(cls, access_token):
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {access_token}"
+        # As on the OAuth2 sessions of python-asana
+        session.token = {"access_token": access_token}
+        return cls(session)
+
+    @classmethod
+    def oauth(cls, **kwargs):
+        from asana.session import AsanaOAuth2Session
+
+        return cls(AsanaOAuth2Session(**kwargs))
+
+    def request(
+        self,
+        method,
+        path,
+        params=None,
+        data=None,
+        headers=None,
+        timeout=None,
+        full_payload=False,
+        **_,
+    ):
+        """Makes a request and returns the data of the response, or with
+        full_payload, all of it. Errors are raised as those of python-asana."""
+        url = self.options["base_url"] + path
+        kwargs = {"headers": dict(self.headers, **(headers or {}))}
+        if params:
+            kwargs["params"] = {
+                key: json.dumps(value) if isinstance(value, bool) else value
+                for key, value in params.items()
+            }
+        if data is not None:
+            kwargs["data"] = json.dumps({"data": data})
+            kwargs["headers"]["Content-Type"] = "application/json"
+        if timeout:
+            kwargs["timeout"] = timeout
+        if self.auth is not None:
+            kwargs["auth"] = self.auth
+        for hook in self.request_hooks:
+            hook(method, url, params)
+        started = time.monotonic()
+        response = getattr(self.session, method)(url, **kwargs)
+        for hook in self.response_hooks:
+            hook(method, url, response, time.monotonic() - started)
+        error = get_error(response)
+        if error is not None:
+            raise error
+        payload = response.json()
+        return payload if full_payload else payload["data"]
+
+    @staticmethod
+    def _get_params(params, options):
+        params = dict(params or {})
+        for key in QUERY_OPTIONS:
+            if options.get(key) is not None:
+                params[key] = options.pop(key)
+        fields = options.pop("fields", None)
+        if fields:
+            params["opt_fields"] = ",".join(fields)
+        return params
+
+    def get(self, path, params=None, **options):
+        return self.request(
+            "get", path, params=self._get_params(params, options), **options
+        )
+
+    def get_collection(self, path, params=None, iterator_type="items", **options):
+        """Returns an iterator over the objects of a collection, or with
+        iterator_type None, the response for one page of it."""
+        if iterator_type is None:
+            return self.get(path, params, **options)
+        return self.paginate(path, params, **options)
+
+    def paginate(self, path, params=None, page_size=None, **options):
+        """Yields the objects of a collection, requesting each page as the
+        objects of the last have been yielded."""
+        params = self._get_params(params, options)
+        params["limit"] = page_size or self.options["page_size"]
+        options["full_payload"] = True
+        while True:
+            payload = self.request("get", path, params=params, **options)
+            yield from payload["data"]
+            next_page = payload.get("next_page")
+            if not next_page:
+                return
+            params = dict(params, offset=next_page["offset"])
+
+    def post(self, path, data, **options):
+        return self.request("post", path, data=data, **options)
+
+    def put(self, path, data, **options):
+        return self.request("put", path, data=data, **options)
+
+    def delete(self, path, data=None, **options):
+        return self.request("delete", path, **options)
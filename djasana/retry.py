@@ -0,0 +1,73 @@
+"""The policy for retrying failed requests to Asana."""
+import random
+
+from asana.error import RateLimitEnforcedError, RetryableAsanaError
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+DEFAULT_EXCEPTIONS = (
+    RetryableAsanaError,
+    ChunkedEncodingError,
+    ConnectionError,
+    Timeout,
+)
+DEFAULT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy(object):
+    """How failed requests to Asana are retried.
+
+    A request is made up to max_attempts times, if it fails with one of the
+    exceptions or with a response of one of the statuses. Retries wait backoff
+    seconds, multiplied by factor for each retry up to max_backoff, plus up to
+    jitter times that at random, so that clients failing together do not retry
+    together. A rate limited request waits as long as Asana's Retry-After instead.
+    If timeout is set, requests time out after that many seconds.
+
+    The defaults match the retries of python-asana. Any of them may be set in the
+    DJASANA_RETRY_POLICY setting, with exceptions given as dotted paths.
+    """
+
+    def __init__(
+        self,
+        max_attempts=6,
+        backoff=1.0,
+        factor=2.0,
+        max_backoff=60.0,
+        jitter=0.1,
+        exceptions=DEFAULT_EXCEPTIONS,
+        statuses=DEFAULT_STATUSES,
+        timeout=None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.exceptions = tuple(
+            import_string(exception) if isinstance(exception, str) else exception
+            for exception in exceptions
+        )
+        self.statuses = frozenset(statuses)
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**getattr(settings, "DJASANA_RETRY_POLICY", None) or {})
+
+    def is_retryable(self, error):
+        if isinstance(error, self.exceptions):
+            return True
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(
+            error, "status", None
+        )
+        return status in self.statuses
+
+    def get_delay(self, retry_count, error=None):
+        """Returns the seconds to wait before the retry after retry_count retries."""
+        if isinstance(error, RateLimitEnforcedError) and error.retry_after:
+            return error.retry_after
+        delay = min(self.backoff * self.factor**retry_count, self.max_backoff)
+        return delay + random.uniform(0, self.jitter * delay)
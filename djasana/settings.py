@@ -5,3 +5,12 @@ settings.DJASANA_WEBHOOK_PATTERN = getattr(
     settings, "DJASANA_WEBHOOK_PATTERN", r"^djasana/webhooks/"
 )
 settings.ASANA_WORKSPACE = getattr(settings, "ASANA_WORKSPACE", None)
+# Between syncs that list every task of a project (deleting local tasks no longer
+# in Asana), sync_from_asana only lists tasks modified since the last sync.
+settings.DJASANA_FULL_SYNC_DAYS = getattr(settings, "DJASANA_FULL_SYNC_DAYS", 7)
+# Whether the webhook view stores events for process_asana_events to apply,
+# rather than applying them before it responds.
+settings.DJASANA_WEBHOOK_INBOX = getattr(settings, "DJASANA_WEBHOOK_INBOX", False)
+# Seconds process_asana_events leaves events in the inbox, so that the events of
+# an edit are applied together, fetching each resource once.
+settings.DJASANA_WEBHOOK_DEBOUNCE = getattr(settings, "DJASANA_WEBHOOK_DEBOUNCE", 0)
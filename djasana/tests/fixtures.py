@@ -61,6 +61,11 @@ def custom_field(**kwargs):
     return fake_response(**defaults)
 
 
+def page(data, offset=None):
+    """A page of a collection, as returned with full_payload"""
+    return {"data": data, "next_page": {"offset": offset} if offset else None}
+
+
 def project(**kwargs):
     defaults = {
         "gid": "1",
@@ -0,0 +1,168 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from asana.error import NotFoundError, ServerError
+from django.test import SimpleTestCase
+from requests.exceptions import ConnectionError
+
+from djasana.aio import AsyncFetcher
+from djasana.retry import RetryPolicy
+from djasana.tests.fixtures import attachment, story, task
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class FakeResponse(object):
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return self.payload
+
+
+class FakeAsyncSession(object):
+    """Stands in for httpx.AsyncClient; routes map a path to response data."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.paths = []
+        self.params = {}
+
+    async def get(self, path, params=None):
+        self.paths.append(path)
+        self.params[path] = params
+        if path not in self.routes:
+            return FakeResponse({"errors": []}, status_code=404)
+        return FakeResponse({"data": self.routes[path]})
+
+    async def aclose(self):
+        pass
+
+
+def fake_client():
+    client = MagicMock()
+    client.options = {"base_url": "https://example.com", "max_retries": 0}
+    return client
+
+
+class AsyncFetcherTestCase(SimpleTestCase):
+    def test_fetch_tasks(self):
+        session = FakeAsyncSession(
+            {
+                "/tasks/1": task(),
+                "/tasks/1/subtasks": [],
+                "/tasks/1/attachments": [{"gid": "2"}],
+                "/attachments/2": attachment(gid="2"),
+                "/tasks/1/stories": [{"gid": "3"}],
+                "/stories/3": story(gid="3"),
+            }
+        )
+        with AsyncFetcher(fake_client(), session=session) as fetcher:
+            results = fetcher.fetch_tasks([{"gid": "1"}])
+        self.assertEqual("Test Task", results[("task", "1")]["name"])
+        self.assertEqual([], results[("subtasks", "1")])
+        self.assertEqual("2", results[("attachment", "2")]["gid"])
+        self.assertEqual("3", results[("story", "3")]["gid"])
+        self.assertEqual(6, len(session.paths))
+
+    def test_no_subtasks_not_fetched(self):
+        session = FakeAsyncSession({"/tasks/1": task(num_subtasks=0)})
+        with AsyncFetcher(fake_client(), session=session) as fetcher:
+            fetcher.fetch_tasks([{"gid": "1"}], attachments=False, stories=False)
+        self.assertEqual(["/tasks/1"], session.paths)
+        # Asana only returns num_subtasks when asked for it
+        self.assertIn("num_subtasks", session.params["/tasks/1"]["opt_fields"])
+
+    def test_errors_are_returned(self):
+        session = FakeAsyncSession({"/tasks/1/subtasks": []})
+        with AsyncFetcher(fake_client(), session=session) as fetcher:
+            results = fetcher.fetch_tasks(
+                [{"gid": "1"}], attachments=False, stories=False
+            )
+        self.assertIsInstance(results[("task", "1")], NotFoundError)
+
+    def test_server_error_retried(self):
+        """Asserts a 500 raises ServerError, which is retried"""
+
+        class FailingSession(FakeAsyncSession):
+            async def get(self, path, params=None):
+                if not self.paths:
+                    self.paths.append(path)
+                    return FakeResponse({"errors": []}, status_code=500)
+                return await super().get(path, params)
+
+        session = FailingSession({"/tasks/1": task(), "/tasks/1/subtasks": []})
+        circuit_breaker = MagicMock()
+        with AsyncFetcher(
+            fake_client(),
+            session=session,
+            retry_policy=RetryPolicy(backoff=0, jitter=0),
+            circuit_breaker=circuit_breaker,
+        ) as fetcher:
+            results = fetcher.fetch_tasks(
+                [{"gid": "1"}], attachments=False, stories=False
+            )
+        self.assertEqual("Test Task", results[("task", "1")]["name"])
+        self.assertEqual(["/tasks/1", "/tasks/1"], session.paths[:2])
+        error = circuit_breaker.record.call_args_list[0].args[0]
+        self.assertIsInstance(error, ServerError)
+        self.assertEqual(500, error.status)
+
+    @unittest.skipIf(httpx is None, "httpx is not installed")
+    def test_connection_error_retried(self):
+        """Asserts httpx errors are retried and recorded as the requests errors
+        they stand for"""
+
+        class FailingSession(FakeAsyncSession):
+            async def get(self, path, params=None):
+                if not self.paths:
+                    self.paths.append(path)
+                    raise httpx.ConnectError("Connection refused")
+                return await super().get(path, params)
+
+        session = FailingSession({"/tasks/1": task(), "/tasks/1/subtasks": []})
+        circuit_breaker = MagicMock()
+        with AsyncFetcher(
+            fake_client(),
+            session=session,
+            retry_policy=RetryPolicy(backoff=0, jitter=0),
+            circuit_breaker=circuit_breaker,
+        ) as fetcher:
+            results = fetcher.fetch_tasks(
+                [{"gid": "1"}], attachments=False, stories=False
+            )
+        self.assertEqual("Test Task", results[("task", "1")]["name"])
+        error = circuit_breaker.record.call_args_list[0].args[0]
+        self.assertIsInstance(error, ConnectionError)
+
+    def test_circuit_breaker_called_outside_event_loop(self):
+        """Asserts the breaker, which uses the Django cache, is not called from
+        the thread of the event loop"""
+        loop_threads = set()
+        breaker_threads = []
+
+        class RecordingSession(FakeAsyncSession):
+            async def get(self, path, params=None):
+                loop_threads.add(threading.get_ident())
+                return await super().get(path, params)
+
+        class RecordingBreaker(object):
+            def before_request(self):
+                breaker_threads.append(threading.get_ident())
+
+            def record(self, error=None):
+                breaker_threads.append(threading.get_ident())
+
+        session = RecordingSession({"/tasks/1": task(num_subtasks=0)})
+        with AsyncFetcher(
+            fake_client(), session=session, circuit_breaker=RecordingBreaker()
+        ) as fetcher:
+            fetcher.fetch_tasks([{"gid": "1"}], attachments=False, stories=False)
+        self.assertEqual(2, len(breaker_threads))
+        self.assertFalse(loop_threads & set(breaker_threads))
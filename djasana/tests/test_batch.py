@@ -0,0 +1,117 @@
+from unittest.mock import MagicMock, patch
+
+from asana.error import NotFoundError, ServerError
+from django.test import SimpleTestCase, override_settings
+
+from djasana.batch import BatchDispatcher, find_by_ids, get_batch_dispatcher
+from djasana.retry import RetryPolicy
+
+
+def result(status_code=200, **data):
+    return {"status_code": status_code, "headers": {}, "body": {"data": data}}
+
+
+def batch(_, data, **__):
+    """Answers each action of a batch with the gid at the end of its path."""
+    return [
+        result(gid=action["relative_path"].rsplit("/", 1)[1])
+        for action in data["actions"]
+    ]
+
+
+class BatchDispatcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.retry_policy = RetryPolicy()
+        self.client.post.side_effect = batch
+
+    def test_get_many(self):
+        batcher = BatchDispatcher(self.client, size=2)
+        self.assertEqual(
+            [{"gid": "1"}, {"gid": "2"}, {"gid": "3"}],
+            batcher.get_many(["/users/1", "/users/2", "/users/3"], fields=["name"]),
+        )
+        self.assertEqual(2, self.client.post.call_count)
+        self.assertEqual(
+            {
+                "relative_path": "/users/3",
+                "method": "get",
+                "options": {"fields": ["name"]},
+            },
+            self.client.post.call_args.args[1]["actions"][0],
+        )
+        # Asana counts each action towards its rate limit
+        self.assertEqual(1, self.client.post.call_args.kwargs["tokens"])
+
+    @patch("djasana.batch.threading.Timer")
+    def test_get_many_not_timed(self, mock_timer):
+        """Asserts get_many sends its GETs without arming the timer"""
+        batcher = BatchDispatcher(self.client, size=2)
+        batcher.get_many(["/users/1", "/users/2", "/users/3"])
+        self.assertFalse(mock_timer.called)
+        self.assertEqual(2, self.client.post.call_count)
+
+    def test_max_wait(self):
+        batcher = BatchDispatcher(self.client, max_wait=0.01)
+        future = batcher.submit("/tags/1")
+        self.assertEqual({"gid": "1"}, future.result(timeout=1))
+
+    def test_errors(self):
+        self.client.post.side_effect = None
+        self.client.post.return_value = [
+            {
+                "status_code": 404,
+                "headers": {},
+                "body": {"errors": [{"message": "Not found"}]},
+            },
+            {"status_code": 500, "headers": {}, "body": {"errors": []}},
+        ]
+        self.client.get.return_value = {"gid": "2"}
+        batcher = BatchDispatcher(self.client)
+        not_found, server_error = batcher.submit("/teams/1"), batcher.submit("/teams/2")
+        batcher.flush()
+        with self.assertRaises(NotFoundError):
+            not_found.result()
+        # Retried on its own
+        self.assertEqual({"gid": "2"}, server_error.result())
+        self.client.get.assert_called_once_with("/teams/2", {}, fields=None)
+
+    def test_rate_limited_without_retry_after(self):
+        self.client.post.side_effect = None
+        self.client.post.return_value = [
+            {"status_code": 429, "headers": {}, "body": {"errors": []}},
+            result(gid="2"),
+        ]
+        self.client.get.return_value = {"gid": "1"}
+        batcher = BatchDispatcher(self.client)
+        self.assertEqual(
+            [{"gid": "1"}, {"gid": "2"}], batcher.get_many(["/users/1", "/users/2"])
+        )
+
+    def test_missing_results(self):
+        """Asserts actions left without a result fail rather than block"""
+        self.client.post.side_effect = None
+        self.client.post.return_value = [result(gid="1")]
+        batcher = BatchDispatcher(self.client)
+        futures = [batcher.submit("/users/1"), batcher.submit("/users/2")]
+        batcher.flush()
+        self.assertEqual({"gid": "1"}, futures[0].result(timeout=1))
+        with self.assertRaises(ServerError):
+            futures[1].result(timeout=1)
+
+    def test_find_by_ids(self):
+        self.client.batcher = BatchDispatcher(self.client, size=2)
+        self.assertEqual(
+            ["1", "2", "3"],
+            [tag["gid"] for tag in find_by_ids(self.client, "tags", ["1", "2", "3"])],
+        )
+        self.assertEqual(2, self.client.post.call_count)
+        self.client.batcher = None
+        self.client.tags.find_by_id.side_effect = lambda gid: {"gid": gid}
+        self.assertEqual([{"gid": "4"}], list(find_by_ids(self.client, "tags", ["4"])))
+
+    @override_settings(DJASANA_BATCH={"size": 5, "max_wait": 0.1})
+    def test_settings(self):
+        batcher = get_batch_dispatcher(self.client)
+        self.assertEqual(5, batcher.size)
+        self.assertEqual(0.1, batcher.max_wait)
@@ -0,0 +1,141 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from djasana.bulk import BulkWriter, IdentityMap
+from djasana.models import Task, User
+
+
+class BulkWriterTestCase(TestCase):
+    def test_upsert(self):
+        User.objects.create(remote_id=1, name="Old name")
+        writer = BulkWriter()
+        writer.add(User, {"remote_id": "1", "name": "New name"})
+        writer.add(User, {"remote_id": "2", "name": "Other"})
+        with self.assertNumQueries(3):  # savepoint, upsert, release
+            writer.flush()
+        self.assertEqual("New name", User.objects.get(remote_id=1).name)
+        self.assertEqual("2", User.objects.get(remote_id=2).gid)
+
+    def test_insert_only(self):
+        User.objects.create(remote_id=1, name="Old name")
+        writer = BulkWriter()
+        writer.add(User, {"remote_id": 1, "name": "New name"}, update=False)
+        writer.add(User, {"remote_id": 2, "name": "Other"}, update=False)
+        writer.flush()
+        self.assertEqual("Old name", User.objects.get(remote_id=1).name)
+        self.assertTrue(User.objects.filter(remote_id=2).exists())
+
+    def test_missing_fields_not_overwritten(self):
+        User.objects.create(remote_id=1, name="Name", email="user@example.com")
+        writer = BulkWriter()
+        writer.add(User, {"remote_id": 1, "name": "New name"})
+        writer.add(User, {"remote_id": 2, "name": "Other", "email": "o@example.com"})
+        writer.flush()
+        user = User.objects.get(remote_id=1)
+        self.assertEqual("New name", user.name)
+        self.assertEqual("user@example.com", user.email)
+
+    def test_related_written_first(self):
+        writer = BulkWriter()
+        writer.add(Task, {"remote_id": 2, "name": "Task", "assignee_id": 1})
+        writer.add(User, {"remote_id": 1, "name": "User"}, update=False)
+        writer.flush()
+        self.assertEqual("User", Task.objects.get(remote_id=2).assignee.name)
+
+    def test_parent_written_first(self):
+        """Asserts a subtask buffered before its parent is written after it"""
+        written = []
+
+        class RecordingWriter(BulkWriter):
+            def _upsert(self, model, objs, update_fields):
+                written.extend(obj.remote_id for obj in objs)
+                super()._upsert(model, objs, update_fields)
+
+        writer = RecordingWriter()
+        writer.add(Task, {"remote_id": 3, "name": "Subsubtask", "parent_id": "2"})
+        writer.add(Task, {"remote_id": 2, "name": "Subtask", "parent_id": 1})
+        writer.add(Task, {"remote_id": 1, "name": "Parent"})
+        writer.flush()
+        self.assertEqual([1, 2, 3], written)
+        self.assertEqual(1, Task.objects.get(remote_id=3).parent.parent_id)
+
+    def test_flush_size(self):
+        writer = BulkWriter(flush_size=2)
+        writer.add(User, {"remote_id": 1, "name": "One"})
+        self.assertFalse(User.objects.exists())
+        writer.add(User, {"remote_id": 2, "name": "Two"})
+        self.assertEqual(2, User.objects.count())
+
+    def test_set_related(self):
+        for remote_id in (1, 2, 3):
+            User.objects.create(remote_id=remote_id, name=str(remote_id))
+        task = Task.objects.create(remote_id=10, name="Task")
+        task.followers.set(User.objects.filter(remote_id__in=[1, 2]))
+        writer = BulkWriter()
+        writer.set_related(Task, "10", "followers", ["2", "3", "404"])
+        writer.flush()
+        self.assertEqual(
+            [2, 3],
+            sorted(task.followers.values_list("remote_id", flat=True)),
+        )
+
+    def test_set_related_unchanged(self):
+        User.objects.create(remote_id=1, name="User")
+        task = Task.objects.create(remote_id=10, name="Task")
+        task.followers.set(User.objects.all())
+        writer = BulkWriter()
+        writer.set_related(Task, 10, "followers", [1])
+        with self.assertNumQueries(5):  # savepoint, pks, pks, rows, release
+            writer.flush()
+        self.assertEqual(1, task.followers.count())
+
+    def test_set_related_add(self):
+        for remote_id in (1, 2):
+            User.objects.create(remote_id=remote_id, name=str(remote_id))
+        task = Task.objects.create(remote_id=10, name="Task")
+        task.followers.set(User.objects.filter(remote_id=1))
+        writer = BulkWriter()
+        writer.set_related(Task, 10, "followers", [2], clear=False)
+        writer.flush()
+        self.assertEqual(2, task.followers.count())
+
+    def test_without_upsert_support(self):
+        User.objects.create(remote_id=1, name="Old name")
+        writer = BulkWriter()
+        writer.add(User, {"remote_id": 1, "name": "New name"})
+        writer.add(User, {"remote_id": 2, "name": "Other"})
+        with patch("djasana.bulk.connections") as connections:
+            connections.__getitem__.return_value.features = object()
+            writer.flush()
+        self.assertEqual("New name", User.objects.get(remote_id=1).name)
+        self.assertTrue(User.objects.filter(remote_id=2).exists())
+
+
+class IdentityMapTestCase(TestCase):
+    def test_known_objects_not_written(self):
+        User.objects.create(remote_id=1, name="User")
+        identity_map = IdentityMap()
+        identity_map.preload(User)
+        writer = BulkWriter(identity_map=identity_map)
+        writer.add(User, {"remote_id": "1", "name": "User"}, update=False)
+        with self.assertNumQueries(0):
+            writer.flush()
+
+    def test_written_objects_known(self):
+        identity_map = IdentityMap()
+        identity_map.preload(User)
+        writer = BulkWriter(identity_map=identity_map)
+        writer.add(User, {"remote_id": 1, "name": "User"}, update=False)
+        self.assertFalse(identity_map.has(User, 1))
+        writer.flush()
+        self.assertTrue(identity_map.has(User, "1"))
+        identity_map.discard(User, ["1"])
+        self.assertFalse(identity_map.has(User, 1))
+
+    def test_only_preloaded_models_tracked(self):
+        identity_map = IdentityMap()
+        writer = BulkWriter(identity_map=identity_map)
+        writer.add(User, {"remote_id": 1, "name": "User"})
+        writer.flush()
+        self.assertFalse(identity_map.has(User, 1))
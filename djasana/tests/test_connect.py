@@ -1,11 +1,28 @@
 import requests
+import threading
 import unittest
+from unittest.mock import MagicMock, patch
 
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.test import override_settings
+from django.test import SimpleTestCase, override_settings
 
-from asana.error import NoAuthorizationError
-from djasana.connect import client_connect
+from asana.error import (
+    NoAuthorizationError,
+    NotFoundError,
+    RateLimitEnforcedError,
+    ServerError,
+)
+from djasana.connect import (
+    CircuitBreaker,
+    CircuitOpenError,
+    Client,
+    client_connect,
+    get_circuit_breaker,
+    get_client,
+    reset_clients,
+)
+from djasana.retry import RetryPolicy
 
 
 class ClientConnectTestCase(unittest.TestCase):
@@ -14,10 +31,128 @@ class ClientConnectTestCase(unittest.TestCase):
         with self.assertRaises(ImproperlyConfigured):
             client_connect()
 
-    @override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE="foo")
+    @override_settings(
+        ASANA_ACCESS_TOKEN="foo",
+        ASANA_WORKSPACE="foo",
+        DJASANA_RETRY_POLICY={"max_attempts": 1},
+        DJASANA_CIRCUIT_BREAKER=None,
+    )
     def test_connect_access_token(self):
         with self.assertRaises(NoAuthorizationError):
             try:
                 client_connect()
             except requests.exceptions.ConnectionError:
                 self.skipTest("No Internet connection")
+
+
+@override_settings(ASANA_ACCESS_TOKEN="foo", ASANA_WORKSPACE="Workspace")
+class GetClientTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        reset_clients()
+        self.addCleanup(reset_clients)
+        patcher = patch("djasana.connect.Client.request")
+        self.mock_request = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_request.return_value = {
+            "data": [{"gid": "1", "name": "Workspace"}],
+            "next_page": None,
+        }
+
+    def test_reused_per_thread(self):
+        client = get_client()
+        self.assertIs(client, get_client())
+        self.assertEqual("1", client.options["workspace_id"])
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(get_client()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(client, clients[0])
+
+    def test_workspace_id_cached(self):
+        client_connect()
+        client_connect()
+        self.assertEqual(1, self.mock_request.call_count)
+
+    def test_settings_changed(self):
+        client = get_client()
+        with self.settings(ASANA_ACCESS_TOKEN="bar"):
+            self.assertIsNot(client, get_client())
+
+    @override_settings(DJASANA_POOL_SIZE=20)
+    def test_pool_size(self):
+        adapter = client_connect().session.get_adapter("https://app.asana.com")
+        self.assertEqual(20, adapter._pool_maxsize)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = MagicMock()
+        self.client = Client(session=self.session)
+        self.client.retry_policy = RetryPolicy(max_attempts=1)
+        self.client.circuit_breaker = CircuitBreaker(threshold=2, cooldown=60)
+
+    @staticmethod
+    def response(status_code):
+        response = MagicMock(status_code=status_code, headers={"Retry-After": "1"})
+        response.json.return_value = {"data": {"gid": "1"}, "errors": []}
+        return response
+
+    def test_opens_after_threshold(self):
+        self.session.get.return_value = self.response(500)
+        for _ in range(2):
+            with self.assertRaises(ServerError):
+                self.client.get("/tasks/1", {})
+        with self.assertRaises(CircuitOpenError) as context:
+            self.client.get("/tasks/1", {})
+        self.assertAlmostEqual(60, context.exception.retry_after, places=0)
+        self.assertEqual(2, self.session.get.call_count)
+
+    def test_success_resets(self):
+        self.session.get.side_effect = [
+            self.response(500),
+            self.response(404),
+            self.response(500),
+        ]
+        with self.assertRaises(ServerError):
+            self.client.get("/tasks/1", {})
+        with self.assertRaises(NotFoundError):
+            self.client.get("/tasks/1", {})
+        with self.assertRaises(ServerError):
+            self.client.get("/tasks/1", {})
+        self.assertIsNone(self.client.circuit_breaker.before_request())
+
+    @patch("djasana.connect.time.time")
+    def test_half_open(self, mock_time):
+        mock_time.return_value = 1000
+        self.session.get.return_value = self.response(500)
+        for _ in range(2):
+            with self.assertRaises(ServerError):
+                self.client.get("/tasks/1", {})
+        mock_time.return_value = 1061
+        with self.assertRaises(ServerError):
+            self.client.get("/tasks/1", {})  # The probe fails
+        with self.assertRaises(CircuitOpenError):
+            self.client.get("/tasks/1", {})
+        mock_time.return_value = 1122
+        self.session.get.return_value = self.response(200)
+        self.assertEqual({"gid": "1"}, self.client.get("/tasks/1", {}))
+        self.assertEqual({"gid": "1"}, self.client.get("/tasks/1", {}))
+
+    def test_one_probe_at_a_time(self):
+        breaker = self.client.circuit_breaker
+        cache.set(f"{breaker.key}:opened_until", 0)
+        breaker.before_request()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_rate_limits_ignored(self):
+        self.assertFalse(
+            CircuitBreaker.is_failure(RateLimitEnforcedError(self.response(429)))
+        )
+        self.assertTrue(CircuitBreaker.is_failure(requests.exceptions.Timeout()))
+
+    @override_settings(DJASANA_CIRCUIT_BREAKER=None)
+    def test_disabled(self):
+        self.assertIsNone(get_circuit_breaker())
@@ -0,0 +1,90 @@
+from datetime import date, datetime
+
+from django.test import TestCase
+
+from djasana.events import apply_change, coalesce
+from djasana.models import Task, User
+
+
+def change_event(gid="1", field="name", new_value="New name", **kwargs):
+    event = {
+        "action": "changed",
+        "created_at": "2017-08-21T18:20:37.972Z",
+        "resource": {"gid": gid, "resource_type": "task"},
+        "change": {"field": field, "action": "changed", "new_value": new_value},
+    }
+    event.update(kwargs)
+    return event
+
+
+class ApplyChangeTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.task = Task.objects.create(
+            remote_id=1, name="Old name", due_on=date(2017, 8, 31)
+        )
+        User.objects.create(remote_id=2, name="User")
+
+    def test_name(self):
+        self.assertTrue(apply_change(change_event()))
+        self.task.refresh_from_db()
+        self.assertEqual("New name", self.task.name)
+
+    def test_completed(self):
+        self.assertTrue(apply_change(change_event(field="completed", new_value=True)))
+        self.task.refresh_from_db()
+        self.assertTrue(self.task.completed)
+        self.assertIsNotNone(self.task.completed_at)
+
+    def test_assignee(self):
+        new_value = {"gid": "2", "resource_type": "user"}
+        self.assertTrue(
+            apply_change(change_event(field="assignee", new_value=new_value))
+        )
+        self.task.refresh_from_db()
+        self.assertEqual(2, self.task.assignee_id)
+
+    def test_due_on(self):
+        self.assertTrue(
+            apply_change(change_event(field="due_on", new_value="2017-09-01"))
+        )
+        self.task.refresh_from_db()
+        self.assertEqual("2017-09-01", self.task.due_on.isoformat())
+
+    def test_fetch_needed(self):
+        """Asserts changes that cannot be applied are left to a fetch"""
+        unknown_user = {"gid": "3", "resource_type": "user"}
+        for event in (
+            change_event(gid="99"),
+            change_event(field="tags", new_value=[]),
+            change_event(field="assignee", new_value=unknown_user),
+            change_event(field="name", new_value=None),
+            change_event(field="due_on", new_value="not a date"),
+            change_event(field="due_at", new_value="not a time"),
+            {"action": "changed", "resource": {"gid": "1", "resource_type": "task"}},
+        ):
+            self.assertFalse(apply_change(event))
+        self.task.refresh_from_db()
+        self.assertEqual("Old name", self.task.name)
+        self.assertEqual("2017-08-31", self.task.due_on.isoformat())
+
+    def test_already_synced(self):
+        Task.objects.filter(pk=self.task.pk).update(
+            remote_modified_at=datetime(2018, 1, 1)
+        )
+        self.assertTrue(apply_change(change_event()))
+        self.task.refresh_from_db()
+        self.assertEqual("Old name", self.task.name)
+
+
+class CoalesceTestCase(TestCase):
+    def test_changes_collapsed_into_fetch(self):
+        fetch = {"action": "changed", "resource": {"gid": "1", "resource_type": "task"}}
+        before, after = change_event(), change_event(field="notes", new_value="")
+        self.assertEqual(
+            [(fetch, [before]), (after, [])], coalesce([before, fetch, after])
+        )
+
+    def test_changes_kept(self):
+        events = [change_event(), change_event(field="completed", new_value=True)]
+        self.assertEqual([(event, []) for event in events], coalesce(events))
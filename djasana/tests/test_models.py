@@ -75,7 +75,7 @@ class TaskModelTestCase(TestCase):
         self.assertEqual("https://app.asana.com/0/4", self.task.asana_url())
 
     @override_settings(ASANA_ACCESS_TOKEN="foo")
-    @patch("djasana.models.client_connect")
+    @patch("djasana.models.get_client")
     def test_delete_from_asana(self, mock_connect):
         mock_client = mock_connect.return_value
         task = models.Task.objects.create(
@@ -90,7 +90,7 @@ class TaskModelTestCase(TestCase):
         self.assertEqual(self.now, self.task.due())
 
     @override_settings(ASANA_ACCESS_TOKEN="foo")
-    @patch("djasana.models.client_connect")
+    @patch("djasana.models.get_client")
     def test_refresh_from_asana(self, mock_connect):
         mock_client = mock_connect.return_value
         task = fixtures.task(gid="4")
@@ -101,7 +101,7 @@ class TaskModelTestCase(TestCase):
         self.assertEqual(task["name"], self.task.name)
 
     @override_settings(ASANA_ACCESS_TOKEN="foo")
-    @patch("djasana.models.client_connect")
+    @patch("djasana.models.get_client")
     def test_sync_to_asana_(self, mock_connect):
         mock_client = mock_connect.return_value
         mock_client.tasks.sync_to_asana.return_value = fixtures.task()
@@ -109,7 +109,7 @@ class TaskModelTestCase(TestCase):
         self.assertTrue(mock_client.tasks.update.called)
 
     @override_settings(ASANA_ACCESS_TOKEN="foo")
-    @patch("djasana.models.client_connect")
+    @patch("djasana.models.get_client")
     def test_add_comment(self, mock_connect):
         mock_client = mock_connect.return_value
         mock_client.tasks.add_comment.return_value = fixtures.story()
@@ -156,7 +156,7 @@ class UserModelTestCase(TestCase):
         cls.user = models.User.objects.create(remote_id=6, name="New User")
 
     @override_settings(ASANA_ACCESS_TOKEN="foo")
-    @patch("djasana.models.client_connect")
+    @patch("djasana.models.get_client")
     def test_refresh_from_asana(self, mock_connect):
         mock_client = mock_connect.return_value
         user = fixtures.user()
@@ -0,0 +1,154 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from asana.error import ServerError
+from django.core.management import call_command
+from django.test import override_settings, TestCase
+from django.utils import timezone
+
+from djasana.connect import CircuitOpenError
+from djasana.models import Project, Task, WebhookEvent, Workspace
+from djasana.tests.fixtures import task
+
+
+def event(gid, action="changed", resource_type="task"):
+    return {"action": action, "resource": {"gid": gid, "resource_type": resource_type}}
+
+
+@patch("djasana.management.commands.process_asana_events.get_client")
+class ProcessAsanaEventsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        workspace = Workspace.objects.create(remote_id=1, name="Workspace")
+        for remote_id in (2, 3):
+            Project.objects.create(
+                remote_id=remote_id, name="Project", public=True, workspace=workspace
+            )
+
+    @staticmethod
+    def process(**options):
+        stdout = StringIO()
+        call_command("process_asana_events", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_processed(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid, name=gid)
+        client.attachments.find_by_task.return_value = []
+        for gid in ("10", "11"):
+            WebhookEvent.objects.create(project_remote_id=2, payload=event(gid))
+        WebhookEvent.objects.create(project_remote_id=3, payload=event("12"))
+        output = self.process(batch_size=2)
+        self.assertIn("3 events processed", output)
+        self.assertEqual(3, Task.objects.count())
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True))
+
+    def test_collapsed(self, mock_client):
+        client = mock_client.return_value
+        client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        client.attachments.find_by_task.return_value = []
+        for gid in ("10", "11", "10", "10"):
+            WebhookEvent.objects.create(project_remote_id=2, payload=event(gid))
+        output = self.process()
+        self.assertIn("4 events processed; 2 events collapsed", output)
+        self.assertEqual(2, client.tasks.find_by_id.call_count)
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True))
+
+    @override_settings(DJASANA_WEBHOOK_DEBOUNCE=60)
+    def test_debounce(self, mock_client):
+        client = mock_client.return_value
+        client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        client.attachments.find_by_task.return_value = []
+        old = WebhookEvent.objects.create(project_remote_id=2, payload=event("10"))
+        WebhookEvent.objects.filter(pk=old.pk).update(
+            received_at=timezone.now() - timedelta(seconds=61)
+        )
+        recent = WebhookEvent.objects.create(project_remote_id=2, payload=event("11"))
+        self.process()
+        old.refresh_from_db()
+        self.assertIsNotNone(old.processed_at)
+        recent.refresh_from_db()
+        self.assertIsNone(recent.processed_at)
+
+    def test_failed_event_retried_in_order(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.tasks.find_by_id.side_effect = [ServerError(), task(gid="11")]
+        client.attachments.find_by_task.return_value = []
+        failing = WebhookEvent.objects.create(project_remote_id=2, payload=event("10"))
+        later = WebhookEvent.objects.create(project_remote_id=2, payload=event("11"))
+        self.process()
+        failing.refresh_from_db()
+        self.assertEqual(1, failing.attempts)
+        self.assertIn("ServerError", failing.error)
+        self.assertGreater(failing.process_after, timezone.now())
+        # The later event of the project waits for the failed one.
+        later.refresh_from_db()
+        self.assertIsNone(later.processed_at)
+
+        WebhookEvent.objects.filter(pk=failing.pk).update(
+            process_after=timezone.now() - timedelta(seconds=1)
+        )
+        client.tasks.find_by_id.side_effect = lambda gid: task(gid=gid)
+        self.process()
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True))
+        self.assertEqual(2, Task.objects.count())
+
+    def test_abandoned(self, mock_get_client):
+        mock_get_client.return_value.tasks.find_by_id.side_effect = ServerError()
+        WebhookEvent.objects.create(project_remote_id=2, payload=event("10"))
+        output = self.process(max_attempts=2, retry_delay=0)
+        self.assertIn("2 failed attempts", output)
+        self.assertIn("1 events abandoned", output)
+
+    def test_circuit_open(self, mock_get_client):
+        mock_get_client.return_value.tasks.find_by_id.side_effect = CircuitOpenError(30)
+        WebhookEvent.objects.create(project_remote_id=2, payload=event("10"))
+        output = self.process()
+        self.assertIn("Stopped", output)
+        self.assertEqual(0, WebhookEvent.objects.get().attempts)
+
+    def test_claimed(self, mock_get_client):
+        """Asserts a run overlapping another leaves the events it has taken"""
+        client = mock_get_client.return_value
+        client.attachments.find_by_task.return_value = []
+        outputs = []
+
+        def find_by_id(gid):
+            outputs.append(self.process())
+            return task(gid=gid)
+
+        client.tasks.find_by_id.side_effect = find_by_id
+        WebhookEvent.objects.create(project_remote_id=2, payload=event("10"))
+        WebhookEvent.objects.create(project_remote_id=2, payload=event("11"))
+        self.assertIn("2 events processed", self.process())
+        self.assertEqual(2, len(outputs))
+        for output in outputs:
+            self.assertIn("0 events processed", output)
+
+    def test_prune(self, mock_get_client):
+        now = timezone.now()
+        old = WebhookEvent.objects.create(
+            project_remote_id=2, payload=event("10"), processed_at=now
+        )
+        WebhookEvent.objects.filter(pk=old.pk).update(
+            processed_at=now - timedelta(days=8)
+        )
+        recent = WebhookEvent.objects.create(
+            project_remote_id=2, payload=event("11"), processed_at=now
+        )
+        pending = WebhookEvent.objects.create(
+            project_remote_id=2,
+            payload=event("12"),
+            process_after=now + timedelta(hours=1),
+        )
+        self.assertIn("1 processed events pruned", self.process(prune_days=7))
+        self.assertEqual(
+            {recent.pk, pending.pk},
+            set(WebhookEvent.objects.values_list("pk", flat=True)),
+        )
+
+    def test_project_deleted(self, mock_get_client):
+        WebhookEvent.objects.create(project_remote_id=99, payload=event("10"))
+        self.process()
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True))
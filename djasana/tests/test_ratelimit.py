@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from djasana.connect import Client
+from djasana.ratelimit import TokenBucket
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_take(self):
+        bucket = TokenBucket(60, self.path, capacity=2)
+        self.assertEqual(0, bucket.take())
+        self.assertEqual(0, bucket.take())
+        self.assertAlmostEqual(1, bucket.take(), places=1)
+
+    def test_take_many(self):
+        bucket = TokenBucket(60, self.path, capacity=2)
+        self.assertEqual(0, bucket.take(2))
+        self.assertAlmostEqual(1, bucket.take(), places=1)
+
+    def test_take_more_than_capacity(self):
+        """Asserts a full bucket gives out more tokens than it holds, going into
+        debt"""
+        bucket = TokenBucket(60, self.path, capacity=2)
+        self.assertEqual(0, bucket.take(4))
+        self.assertAlmostEqual(3, bucket.take(), places=1)
+
+    def test_shared(self):
+        """Asserts buckets with the same path share tokens, as across processes."""
+        TokenBucket(60, self.path, capacity=1).take()
+        self.assertGreater(TokenBucket(60, self.path, capacity=1).take(), 0)
+
+    def test_block(self):
+        bucket = TokenBucket(60, self.path)
+        bucket.block(30)
+        self.assertAlmostEqual(30, bucket.take(), places=0)
+
+    @patch("djasana.ratelimit.time.sleep")
+    def test_acquire(self, mock_sleep):
+        bucket = TokenBucket(60, self.path, capacity=1)
+        bucket.take()
+        with patch.object(bucket, "take", side_effect=[0.5, 0]):
+            self.assertEqual(0.5, bucket.acquire())
+        mock_sleep.assert_called_once_with(0.5)
+
+
+class RateLimitedClientTestCase(unittest.TestCase):
+    @staticmethod
+    def response(status_code, **headers):
+        response = MagicMock(status_code=status_code, headers=headers)
+        response.json.return_value = {"data": {"gid": "1"}, "errors": []}
+        return response
+
+    @patch("djasana.connect.time.sleep")
+    def test_retry_after(self, mock_sleep):
+        session = MagicMock()
+        session.get.side_effect = [
+            self.response(429, **{"Retry-After": "2"}),
+            self.response(200),
+        ]
+        client = Client(session=session)
+        self.assertEqual({"gid": "1"}, client.get("/tasks/1", {}))
+        mock_sleep.assert_called_once_with(2.0)
+        self.assertEqual(2.0, client.throttled_seconds)
+
+    def test_retry_after_blocks_rate_limiter(self):
+        session = MagicMock()
+        session.get.side_effect = [
+            self.response(429, **{"Retry-After": "2"}),
+            self.response(200),
+        ]
+        client = Client(session=session)
+        client.rate_limiter = MagicMock()
+        client.rate_limiter.acquire.return_value = 1.5
+        client.get("/tasks/1", {})
+        client.rate_limiter.block.assert_called_once_with(2.0)
+        self.assertEqual(2, client.rate_limiter.acquire.call_count)
+        self.assertEqual(3.0, client.throttled_seconds)
+
+    def test_tokens(self):
+        """Asserts a request takes as many tokens as its tokens option says, which
+        is not sent to Asana"""
+        session = MagicMock()
+        session.post.return_value = self.response(200)
+        client = Client(session=session)
+        client.rate_limiter = MagicMock()
+        client.rate_limiter.acquire.return_value = 0
+        client.post("/batch", {"actions": []}, tokens=3)
+        client.rate_limiter.acquire.assert_called_once_with(3)
+        self.assertNotIn("tokens", session.post.call_args.kwargs["data"])
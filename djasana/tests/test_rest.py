@@ -0,0 +1,190 @@
+import json
+from unittest.mock import MagicMock, patch
+
+from asana.error import InvalidTokenError, NotFoundError
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+
+from djasana import models, views
+from djasana.connect import NativeClient, client_connect, reset_clients
+from djasana.retry import RetryPolicy
+from djasana.rest import RestClient
+from djasana.tests.fixtures import attachment, task
+from djasana.utils import sign_sha256_hmac
+from djasana.webhooks import webhook_cache
+
+BASE_URL = "https://app.asana.com/api/1.0"
+
+
+def response(status_code=200, **payload):
+    response = MagicMock(status_code=status_code, headers={})
+    response.json.return_value = payload
+    return response
+
+
+class FakeSession(object):
+    """Stands in for a requests session; routes map a path to response payloads,
+    returned in turn."""
+
+    def __init__(self, routes):
+        self.routes = {path: list(payloads) for path, payloads in routes.items()}
+        self.requests = []
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        path = url[len(BASE_URL) :]
+        self.requests.append((method, path, kwargs))
+        if not self.routes.get(path):
+            return response(404, errors=[{"message": "Not found"}])
+        return response(**self.routes[path].pop(0))
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+
+class RestClientTestCase(SimpleTestCase):
+    def test_get(self):
+        session = FakeSession({"/tasks/1": [{"data": {"gid": "1"}}]})
+        client = RestClient(session)
+        self.assertEqual(
+            {"gid": "1"}, client.tasks.find_by_id("1", fields=["name", "notes"])
+        )
+        self.assertEqual({"opt_fields": "name,notes"}, session.requests[0][2]["params"])
+
+    def test_paginate(self):
+        session = FakeSession(
+            {
+                "/projects": [
+                    {"data": [{"gid": "1"}], "next_page": {"offset": "a"}},
+                    {"data": [{"gid": "2"}], "next_page": None},
+                ]
+            }
+        )
+        client = RestClient(session, page_size=1)
+        projects = client.projects.find_all({"workspace": "9", "archived": False})
+        self.assertEqual({"gid": "1"}, next(projects))
+        self.assertEqual(1, len(session.requests))  # Streamed lazily
+        self.assertEqual([{"gid": "2"}], list(projects))
+        self.assertEqual(
+            {"workspace": "9", "archived": "false", "limit": 1, "offset": "a"},
+            session.requests[1][2]["params"],
+        )
+
+    def test_one_page(self):
+        payload = {"data": [{"gid": "1"}], "next_page": {"offset": "b"}}
+        session = FakeSession({"/tasks": [payload]})
+        client = RestClient(session)
+        self.assertEqual(
+            payload,
+            client.tasks.find_all(
+                {"project": "1"},
+                full_payload=True,
+                iterator_type=None,
+                limit=50,
+                offset="a",
+            ),
+        )
+        self.assertEqual(
+            {"project": "1", "limit": 50, "offset": "a"},
+            session.requests[0][2]["params"],
+        )
+
+    def test_post(self):
+        session = FakeSession({"/tasks/1/stories": [{"data": {"gid": "2"}}]})
+        RestClient(session).tasks.add_comment("1", {"text": "Comment"})
+        self.assertEqual(
+            {"data": {"text": "Comment"}}, json.loads(session.requests[0][2]["data"])
+        )
+
+    def test_errors(self):
+        client = RestClient(FakeSession({}))
+        with self.assertRaises(NotFoundError):
+            client.tasks.find_by_id("1")
+        session = MagicMock()
+        session.get.return_value = response(412, sync="token", errors=[])
+        with self.assertRaises(InvalidTokenError) as context:
+            RestClient(session).events.get({"resource": "1"})
+        self.assertEqual("token", context.exception.sync)
+
+    def test_hooks(self):
+        session = FakeSession({"/users/1": [{"data": {"gid": "1"}}]})
+        client = RestClient(session)
+        request_hook, response_hook = MagicMock(), MagicMock()
+        client.request_hooks.append(request_hook)
+        client.response_hooks.append(response_hook)
+        client.users.find_by_id("1")
+        request_hook.assert_called_once_with("get", BASE_URL + "/users/1", {})
+        self.assertEqual(200, response_hook.call_args.args[2].status_code)
+
+    @patch("djasana.connect.time.sleep")
+    def test_native_client_retries(self, mock_sleep):
+        session = MagicMock()
+        session.get.side_effect = [response(503), response(data={"gid": "1"})]
+        client = NativeClient(session)
+        client.retry_policy = RetryPolicy(jitter=0)
+        self.assertEqual({"gid": "1"}, client.tasks.find_by_id("1"))
+        mock_sleep.assert_called_once_with(1.0)
+
+    @override_settings(
+        ASANA_ACCESS_TOKEN="foo",
+        ASANA_WORKSPACE=None,
+        DJASANA_CLIENT_CLASS="djasana.connect.NativeClient",
+    )
+    def test_client_connect(self):
+        client = client_connect()
+        self.assertIsInstance(client, NativeClient)
+        self.assertEqual("Bearer foo", client.session.headers["Authorization"])
+
+
+@override_settings(
+    ASANA_ACCESS_TOKEN="foo",
+    ASANA_WORKSPACE=None,
+    DJASANA_CLIENT_CLASS="djasana.connect.NativeClient",
+)
+class NativeClientWebhookTestCase(TestCase):
+    """Asserts the webhook view runs on the native client."""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+        cache.clear()
+        webhook_cache.clear()
+
+    def test_task_changed(self):
+        workspace = models.Workspace.objects.create(remote_id=1, name="Workspace")
+        project = models.Project.objects.create(
+            remote_id=3, name="Project", public=True, workspace=workspace
+        )
+        secret = "a" * 32
+        models.Webhook.objects.create(project=project, secret=secret)
+        session = FakeSession(
+            {
+                "/tasks/1": [{"data": task()}],
+                "/tasks/1/attachments": [{"data": [{"gid": "1"}], "next_page": None}],
+                "/attachments/1": [{"data": attachment()}],
+            }
+        )
+        message = json.dumps(
+            {
+                "events": [
+                    {
+                        "action": "changed",
+                        "resource": {"gid": "1", "resource_type": "task"},
+                    }
+                ]
+            }
+        )
+        request = RequestFactory().post(
+            "",
+            content_type="application/json",
+            data=message,
+            **{"X-Hook-Signature": sign_sha256_hmac(secret, message)}
+        )
+        with patch("djasana.rest.requests.Session", return_value=session):
+            response_ = views.WebhookView.as_view()(request, remote_id=3)
+        self.assertEqual(200, response_.status_code)
+        self.assertEqual("Test Task", models.Task.objects.get(remote_id=1).name)
+        self.assertTrue(models.Attachment.objects.filter(remote_id=1).exists())
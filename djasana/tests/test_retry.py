@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from asana.error import InvalidRequestError, RateLimitEnforcedError, ServerError
+from django.test import override_settings
+from requests.exceptions import ConnectionError
+
+from djasana.connect import Client
+from djasana.retry import RetryPolicy
+
+
+def response(status_code, **headers):
+    response = MagicMock(status_code=status_code, headers=headers)
+    response.json.return_value = {"data": {"gid": "1"}, "errors": []}
+    return response
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_is_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable(ServerError(response(502))))
+        self.assertTrue(policy.is_retryable(ConnectionError()))
+        self.assertFalse(policy.is_retryable(InvalidRequestError(response(400))))
+        self.assertFalse(policy.is_retryable(ValueError()))
+
+    def test_statuses(self):
+        policy = RetryPolicy(exceptions=(), statuses=(400,))
+        self.assertTrue(policy.is_retryable(InvalidRequestError(response(400))))
+        self.assertFalse(policy.is_retryable(ServerError(response(500))))
+
+    def test_get_delay(self):
+        policy = RetryPolicy(backoff=1, factor=2, max_backoff=5, jitter=0)
+        self.assertEqual([1, 2, 4, 5], [policy.get_delay(n) for n in range(4)])
+        error = RateLimitEnforcedError(response(429, **{"Retry-After": "30"}))
+        self.assertEqual(30, policy.get_delay(0, error))
+
+    def test_jitter(self):
+        policy = RetryPolicy(backoff=10, jitter=0.5)
+        delays = [policy.get_delay(0) for _ in range(20)]
+        self.assertTrue(all(10 <= delay <= 15 for delay in delays))
+
+    @override_settings(
+        DJASANA_RETRY_POLICY={
+            "max_attempts": 2,
+            "exceptions": ["requests.exceptions.ConnectionError"],
+            "timeout": 10,
+        }
+    )
+    def test_from_settings(self):
+        policy = RetryPolicy.from_settings()
+        self.assertEqual(2, policy.max_attempts)
+        self.assertEqual((ConnectionError,), policy.exceptions)
+        self.assertEqual(10, policy.timeout)
+
+
+@patch("djasana.connect.time.sleep")
+class RetryingClientTestCase(unittest.TestCase):
+    def test_retries(self, mock_sleep):
+        session = MagicMock()
+        session.get.side_effect = [ConnectionError(), response(503), response(200)]
+        client = Client(session=session)
+        client.retry_policy = RetryPolicy(jitter=0)
+        self.assertEqual({"gid": "1"}, client.get("/tasks/1", {}))
+        self.assertEqual([1.0, 2.0], [c.args[0] for c in mock_sleep.call_args_list])
+
+    def test_max_attempts(self, mock_sleep):
+        session = MagicMock()
+        session.get.return_value = response(500)
+        client = Client(session=session)
+        client.retry_policy = RetryPolicy(max_attempts=3)
+        with self.assertRaises(ServerError):
+            client.get("/tasks/1", {})
+        self.assertEqual(3, session.get.call_count)
+
+    def test_not_retryable(self, mock_sleep):
+        session = MagicMock()
+        session.get.return_value = response(400)
+        client = Client(session=session)
+        with self.assertRaises(InvalidRequestError):
+            client.get("/tasks/1", {})
+        self.assertEqual(1, session.get.call_count)
+        self.assertFalse(mock_sleep.called)
+
+    def test_timeout(self, mock_sleep):
+        session = MagicMock()
+        session.get.return_value = response(200)
+        client = Client(session=session)
+        client.retry_policy = RetryPolicy(timeout=10)
+        client.get("/tasks/1", {})
+        self.assertEqual(10, session.get.call_args.kwargs["timeout"])
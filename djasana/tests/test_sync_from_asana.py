@@ -4,12 +4,15 @@ from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.db import IntegrityError
 from django.test import override_settings, TestCase
+from django.utils import timezone
 from djasana.management.commands.sync_from_asana import Command
 from djasana.models import (
     Attachment,
     CustomField,
     CustomFieldSetting,
     Project,
+    ProjectSync,
+    SyncCheckpoint,
     Story,
     SyncToken,
     Tag,
@@ -19,9 +22,13 @@ from djasana.models import (
     Workspace,
     User,
 )
+from djasana.aio import AsyncFetcher
+from djasana.batch import BatchDispatcher
+from djasana.connect import CircuitOpenError
 from djasana.tests.fixtures import (
     attachment,
     custom_field,
+    page,
     project,
     story,
     tag,
@@ -31,6 +38,8 @@ from djasana.tests.fixtures import (
     webhook,
     workspace,
 )
+from djasana.tests.test_aio import FakeAsyncSession
+from djasana.utils import STORY_FIELDS, TASK_FIELDS
 
 
 def mock_connect():
@@ -81,14 +90,64 @@ class SyncFromAsanaTestCase(TestCase):
     def setUp(self):
         self.command = Command()
         self.command.client = MagicMock()
+        self.command.client.batcher = None
         self.command.client.workspaces.find_all.return_value = [workspace()]
         self.command.client.workspaces.find_by_id.return_value = workspace()
         self.command.client.projects.find_all.return_value = [project()]
         self.command.client.projects.find_by_id.return_value = project()
-        self.command.client.tasks.find_all.return_value = [task()]
+        self.command.client.tasks.find_all.return_value = page([task()])
         self.command.client.tasks.find_by_id.return_value = task()
         self.command.client.tasks.subtasks.return_value = []
 
+    @patch("djasana.management.commands.sync_from_asana.Command._check_sync_project_id")
+    def test_jobs(self, mock_check_sync):
+        self.command.client.projects.find_all.return_value = [
+            project(gid=str(gid)) for gid in range(1, 4)
+        ]
+        self.command.handle(interactive=False, jobs=2)
+        synced_ids = sorted(call[0][0] for call in mock_check_sync.call_args_list)
+        self.assertEqual(["1", "2", "3"], synced_ids)
+
+    @patch("djasana.management.commands.sync_from_asana.Command._check_sync_project_id")
+    def test_jobs_failure_reported(self, mock_check_sync):
+        def fail_on_two(project_id, *_):
+            if project_id == "2":
+                raise ValueError("Boom")
+
+        mock_check_sync.side_effect = fail_on_two
+        self.command.client.projects.find_all.return_value = [
+            project(gid=str(gid)) for gid in range(1, 4)
+        ]
+        logger_name = "djasana.management.commands.sync_from_asana"
+        with self.assertLogs(logger_name, "ERROR"), self.assertRaisesMessage(
+            CommandError, "Failed to sync 1 projects: 2"
+        ):
+            self.command.handle(interactive=False, jobs=2)
+        self.assertEqual(3, mock_check_sync.call_count)
+
+    def test_async_engine(self):
+        session = FakeAsyncSession(
+            {
+                "/tasks/1": task(),
+                "/tasks/1/subtasks": [],
+                "/tasks/1/attachments": [{"gid": "1"}],
+                "/attachments/1": attachment(),
+                "/tasks/1/stories": [{"gid": "1"}],
+                "/stories/1": story(),
+            }
+        )
+        self.command.client.options = {"max_retries": 0}
+        with patch.object(Command, "get_async_fetcher") as mock_fetcher:
+            mock_fetcher.return_value = AsyncFetcher(
+                self.command.client, session=session
+            )
+            self.command.handle(interactive=False, engine="async")
+        self.assertEqual(1, Task.objects.count())
+        self.assertEqual(1, Attachment.objects.count())
+        self.assertEqual(1, Story.objects.count())
+        self.assertFalse(self.command.client.tasks.find_by_id.called)
+        self.assertFalse(self.command.client.stories.find_by_id.called)
+
     def test_interactive(self):
         with patch.object(Command, "_confirm") as mock_confirm:
             mock_confirm.return_value = False
@@ -220,11 +279,58 @@ class SyncFromAsanaTestCase(TestCase):
         except Story.DoesNotExist:
             self.fail("Story not created")
 
+    def test_sync_events_change_applied(self):
+        workspace_ = Workspace.objects.create(remote_id=1, name="New Workspace")
+        project_ = Project.objects.create(
+            remote_id=1, name="New Project", public=True, workspace=workspace_
+        )
+        Task.objects.create(remote_id=1337, name="Old Name")
+        SyncToken.objects.create(sync="foo", project=project_)
+        self.command.client.events.get.return_value = {
+            "data": [
+                {
+                    "action": "changed",
+                    "change": {
+                        "action": "changed",
+                        "field": "completed",
+                        "new_value": True,
+                    },
+                    "created_at": "2017-08-21T18:20:37.972Z",
+                    "parent": None,
+                    "resource": {"gid": "1337", "name": "Old Name"},
+                    "type": "task",
+                    "user": "1123",
+                },
+            ]
+        }
+        self.command.handle(interactive=False, project=["1"], workspace=["1"])
+        self.command.client.tasks.find_by_id.assert_not_called()
+        self.assertTrue(Task.objects.get(remote_id=1337).completed)
+        self.assertEqual(1, self.command.counts["changes_applied"])
+
+    def test_batched(self):
+        def batch(_, data, **__):
+            return [
+                {
+                    "status_code": 200,
+                    "body": {"data": user(gid=action["relative_path"].split("/")[2])},
+                }
+                for action in data["actions"]
+            ]
+
+        self.command.client.batcher = BatchDispatcher(self.command.client)
+        self.command.client.users.find_all.return_value = [{"gid": "1"}, {"gid": "2"}]
+        self.command.client.post.side_effect = batch
+        self.command.handle(interactive=False, model=["Workspace", "User"])
+        self.assertEqual(2, User.objects.count())
+        self.assertEqual(1, self.command.client.post.call_count)
+        self.assertFalse(self.command.client.users.find_by_id.called)
+
     def test_null_email_passes(self):
         null_user = user(email=None)
         self.command.client.users.find_by_id.return_value = null_user
         try:
-            self.command._sync_user(user=null_user, workspace=None)
+            self.command._sync_user(user_dict=null_user, workspace=None)
         except IntegrityError as error:
             self.fail(error)
 
@@ -246,7 +352,9 @@ class SyncFromAsanaTestCase(TestCase):
         parent_task = task()
         parent_copy = parent_task.copy()
         child_task = task(gid="2", parent=parent_task)
-        self.command.client.tasks.find_all.return_value = [child_task, parent_task]
+        self.command.client.tasks.find_all.return_value = page(
+            [child_task, parent_task]
+        )
         self.command.client.tasks.find_by_id.side_effect = [
             child_task,
             parent_task,
@@ -257,12 +365,210 @@ class SyncFromAsanaTestCase(TestCase):
         parent, child = tuple(Task.objects.order_by("remote_id"))
         self.assertEqual(parent, child.parent)
 
+    def test_listed_task_not_fetched(self):
+        """Asserts a task listed with all its fields is not fetched again."""
+        listed_task = task(**{field.split(".")[0]: None for field in TASK_FIELDS})
+        listed_task.update(task(assignee_status="upcoming", created_at=timezone.now()))
+        self.command.client.tasks.find_all.return_value = page([listed_task])
+        self.command.handle(interactive=False)
+        self.assertEqual(1, Task.objects.count())
+        self.assertEqual(
+            TASK_FIELDS, self.command.client.tasks.find_all.call_args[1]["fields"]
+        )
+        self.assertFalse(self.command.client.tasks.find_by_id.called)
+
+    def test_listed_stories_not_fetched(self):
+        """Asserts stories listed with all their fields are not fetched again."""
+        listed_stories = [
+            story(
+                gid=str(gid),
+                created_at=timezone.now(),
+                html_text="<body>Done</body>",
+                is_edited=False,
+                is_pinned=False,
+                source="web",
+                text="Done",
+                type="comment",
+            )
+            for gid in (1, 2)
+        ]
+        self.command.client.stories.find_by_task.return_value = listed_stories
+        self.command.handle(interactive=False, model_exclude=["Attachment"])
+        self.assertEqual(2, Story.objects.count())
+        self.assertEqual(
+            STORY_FIELDS,
+            self.command.client.stories.find_by_task.call_args[1]["fields"],
+        )
+        self.assertFalse(self.command.client.stories.find_by_id.called)
+
+    def _return_fresh_responses(self):
+        """Since responses get modified in place, return new ones each call
+        for syncing more than once."""
+        client = self.command.client
+        client.workspaces.find_by_id.side_effect = lambda *_: workspace()
+        client.projects.find_by_id.side_effect = lambda *_: project()
+        client.tasks.find_by_id.side_effect = task
+        client.attachments.find_by_task.side_effect = lambda *_, **__: [attachment()]
+        client.attachments.find_by_id.side_effect = lambda *_: attachment()
+        client.stories.find_by_task.side_effect = lambda *_, **__: [story()]
+        client.stories.find_by_id.side_effect = lambda *_: story()
+
+    def test_known_stories_and_attachments_skipped(self):
+        self._return_fresh_responses()
+        self.command.handle(interactive=False)
+        self.command.client.attachments.find_by_id.reset_mock()
+        self.command.client.stories.find_by_id.reset_mock()
+        self.command.handle(interactive=False)
+        self.assertFalse(self.command.client.attachments.find_by_id.called)
+        self.assertFalse(self.command.client.stories.find_by_id.called)
+        self.assertEqual(1, self.command.counts["known_attachments_skipped"])
+        self.assertEqual(1, self.command.counts["known_stories_skipped"])
+
+    def test_refresh_immutable(self):
+        self._return_fresh_responses()
+        self.command.handle(interactive=False)
+        self.command.client.stories.find_by_id.side_effect = lambda *_: story(
+            text="Edited"
+        )
+        self.command.handle(interactive=False, refresh_immutable=True)
+        self.assertEqual("Edited", Story.objects.get(remote_id=1).text)
+        self.assertEqual(1, Attachment.objects.count())
+
+    def test_modified_since(self):
+        """Asserts only tasks modified since the last sync are listed, and
+        no tasks are deleted."""
+        self._return_fresh_responses()
+        self.command.handle(interactive=False)
+        synced_at = ProjectSync.objects.get(project_id=1).synced_at
+        self.command.client.tasks.find_all.return_value = page([])
+        self.command.handle(interactive=False)
+        query = self.command.client.tasks.find_all.call_args[0][0]
+        self.assertEqual(synced_at.isoformat(), query["modified_since"])
+        self.assertEqual(1, Task.objects.count())
+
+    def test_full(self):
+        self._return_fresh_responses()
+        self.command.handle(interactive=False)
+        self.assertEqual({1}, self.command.synced_ids)
+        self.command.client.tasks.find_all.return_value = page([])
+        self.command.handle(interactive=False, full=True)
+        query = self.command.client.tasks.find_all.call_args[0][0]
+        self.assertNotIn("modified_since", query)
+        self.assertEqual(set(), self.command.synced_ids)
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(DJASANA_FULL_SYNC_DAYS=0)
+    def test_full_sync_due(self):
+        self._return_fresh_responses()
+        self.command.handle(interactive=False)
+        self.command.client.tasks.find_all.return_value = page([])
+        self.command.handle(interactive=False)
+        query = self.command.client.tasks.find_all.call_args[0][0]
+        self.assertNotIn("modified_since", query)
+
+    @staticmethod
+    def _listed_task(gid):
+        """Returns a task listed with all of TASK_FIELDS."""
+        listed_task = task(**{field.split(".")[0]: None for field in TASK_FIELDS})
+        listed_task.update(
+            task(gid=gid, assignee_status="upcoming", created_at=timezone.now())
+        )
+        return listed_task
+
+    def test_max_duration_and_resume(self):
+        def find_all(query, **options):
+            if options.get("offset") == "next":
+                return page([self._listed_task("2"), self._listed_task("3")])
+            return page([self._listed_task("1")], offset="next")
+
+        self._return_fresh_responses()
+        self.command.client.tasks.find_all.side_effect = find_all
+        with patch("djasana.management.commands.sync_from_asana.time") as mock_time:
+            # The deadline passes once task 2 is synced.
+            mock_time.monotonic.side_effect = [0, 0, 0, 100]
+            self.command.handle(interactive=False, max_duration=60)
+        self.assertEqual(2, Task.objects.count())
+        checkpoint = SyncCheckpoint.objects.get()
+        self.assertEqual(1, checkpoint.project_remote_id)
+        self.assertEqual("next", checkpoint.offset)
+        self.assertEqual(2, checkpoint.task_remote_id)
+
+        self.command.handle(interactive=False, resume=True)
+        self.assertEqual(
+            "next", self.command.client.tasks.find_all.call_args[1]["offset"]
+        )
+        self.assertEqual({3}, self.command.synced_ids)
+        self.assertEqual(3, Task.objects.count())
+        self.assertFalse(SyncCheckpoint.objects.exists())
+        # Tasks synced before the interruption are not known to the resumed run,
+        # so it must not count as a full sync.
+        self.assertIsNone(ProjectSync.objects.get().full_synced_at)
+
+    def test_circuit_open(self):
+        """Asserts the run stops at a checkpoint while Asana is failing."""
+
+        def find_by_id(task_id, **_):
+            if task_id == "2":
+                raise CircuitOpenError(30)
+            return task(gid=task_id)
+
+        self._return_fresh_responses()
+        self.command.client.tasks.find_all.return_value = page(
+            [self._listed_task("1"), {"gid": "2"}]
+        )
+        self.command.client.tasks.find_by_id.side_effect = find_by_id
+        self.command.handle(interactive=False)
+        self.assertTrue(Task.objects.filter(remote_id=1).exists())
+        self.assertTrue(SyncCheckpoint.objects.exists())
+        self.assertFalse(ProjectSync.objects.exists())
+
+    def test_resume_skips_completed_projects(self):
+        SyncCheckpoint.objects.create(workspace_remote_id=1, completed_project_ids=[1])
+        self.command.handle(interactive=False, resume=True)
+        self.assertFalse(self.command.client.projects.find_by_id.called)
+
+    def test_unchanged_task_skipped(self):
+        modified_at = timezone.now()
+        self._return_fresh_responses()
+        self.command.client.tasks.find_by_id.side_effect = lambda *_, **__: task(
+            modified_at=modified_at
+        )
+        self.command.handle(interactive=False)
+        self.command.client.tasks.find_by_id.side_effect = lambda *_, **__: task(
+            modified_at=modified_at, name="Not modified in Asana"
+        )
+        self.command.handle(interactive=False)
+        self.assertEqual("Test Task", Task.objects.get(remote_id=1).name)
+        self.assertEqual(1, self.command.counts["unchanged_tasks_skipped"])
+
+    def test_unchanged_task_skipped_asana_timestamp(self):
+        """Asserts tasks are synced with the aware timestamps Asana returns"""
+        self._return_fresh_responses()
+        self.command.client.tasks.find_by_id.side_effect = lambda *_, **__: task(
+            modified_at="2012-02-22T02:06:58.147Z"
+        )
+        self.command.handle(interactive=False)
+        self.assertIsNotNone(Task.objects.get(remote_id=1).remote_modified_at)
+        self.command.handle(interactive=False)
+        self.assertEqual(1, self.command.counts["unchanged_tasks_skipped"])
+
+    def test_no_subtasks_not_fetched(self):
+        self.command.client.tasks.find_by_id.return_value = task(num_subtasks=0)
+        self.command.handle(interactive=False)
+        # Asana only returns num_subtasks when asked for it
+        self.assertEqual(
+            TASK_FIELDS, self.command.client.tasks.find_by_id.call_args.kwargs["fields"]
+        )
+        self.assertEqual(1, Task.objects.count())
+        self.assertFalse(self.command.client.tasks.subtasks.called)
+        self.assertEqual(1, self.command.counts["subtask_requests_avoided"])
+
     def test_subtask(self):
         """Asserts subtask (task related to a task but not a project) is supported."""
         parent_task = task(projects=None)  # Parent is also a subtask
         subtask = task(gid="2", projects=None, parent=parent_task.copy())
 
-        self.command.client.tasks.find_all.return_value = [parent_task.copy()]
+        self.command.client.tasks.find_all.return_value = page([parent_task.copy()])
         self.command.client.tasks.subtasks.side_effect = [[subtask.copy()], []]
         self.command.client.tasks.find_by_id.side_effect = [
             parent_task.copy(),
@@ -287,7 +593,7 @@ class SyncFromAsanaTestCase(TestCase):
         project_dict = project(gid="3")
         self.command.client.projects.find_all.return_value = [project_dict]
         self.command.client.projects.find_by_id.return_value = project_dict
-        self.command.client.tasks.find_all.return_value = []
+        self.command.client.tasks.find_all.return_value = page([])
         self.command.handle(interactive=False, project=["Test Project"])
         self.assertFalse(Task.objects.filter(pk=task_.pk).exists())
 
@@ -320,7 +626,9 @@ class SyncFromAsanaTestCase(TestCase):
         # When processed, tasks get modified in place;
         # we need to pass the original twice.
         child_copy = child_task.copy()
-        self.command.client.tasks.find_all.return_value = [parent_task, child_task]
+        self.command.client.tasks.find_all.return_value = page(
+            [parent_task, child_task]
+        )
         self.command.client.tasks.find_by_id.side_effect = [
             parent_task,
             child_task,
@@ -340,7 +648,9 @@ class SyncFromAsanaTestCase(TestCase):
         # When processed, tasks get modified in place;
         # we need to pass the original twice.
         dependent_copy = dependent_task.copy(), dependent_task.copy()
-        self.command.client.tasks.find_all.return_value = [main_task, dependent_task]
+        self.command.client.tasks.find_all.return_value = page(
+            [main_task, dependent_task]
+        )
         self.command.client.tasks.find_by_id.side_effect = [
             main_task,
             dependent_task,
@@ -354,6 +664,16 @@ class SyncFromAsanaTestCase(TestCase):
         self.assertTrue(main_task in dependent_task.dependencies.all())
         self.assertTrue(dependent_task in main_task.dependents.all())
 
+    def test_followers_synced(self):
+        User.objects.create(remote_id=5, name="Not a follower")
+        follower = user(gid="7", name="Follower")
+        self.command.client.tasks.find_by_id.return_value = task(
+            assignee=follower, followers=[follower]
+        )
+        self.command.handle(interactive=False)
+        task_ = Task.objects.get(remote_id=1)
+        self.assertEqual([7], list(task_.followers.values_list("remote_id", flat=True)))
+
     def test_custom_fields(self):
         workspace_ = Workspace.objects.create(remote_id=1, name="Workspace")
         team_ = Team.objects.create(remote_id=2, name="Team")
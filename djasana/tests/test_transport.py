@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+
+from asana.error import ServerError
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+from requests.exceptions import ConnectionError
+
+from djasana.aio import AsyncFetcher
+from djasana.connect import Client, HTTPXTransport, client_connect
+from djasana.rest import RestClient
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class HTTPXTransportTestCase(SimpleTestCase):
+    @staticmethod
+    def handler(request):
+        if request.url.path == "/api/1.0/tasks/1":
+            return httpx.Response(
+                200,
+                json={"data": {"gid": "1", "auth": request.headers["authorization"]}},
+            )
+        if request.url.path == "/api/1.0/tasks/3":
+            return httpx.Response(503, json={"errors": [{"message": "Down"}]})
+        raise httpx.ConnectError("Connection refused")
+
+    def get_transport(self):
+        transport = HTTPXTransport(token="foo")
+        transport.session = httpx.Client(
+            transport=httpx.MockTransport(self.handler),
+            headers=transport.session.headers,
+        )
+        return transport
+
+    def get_client(self):
+        client = Client(session=self.get_transport())
+        client.retry_policy.max_attempts = 1
+        return client
+
+    def test_request(self):
+        self.assertEqual(
+            {"gid": "1", "auth": "Bearer foo"},
+            self.get_client().get("/tasks/1", {}),
+        )
+
+    def test_errors_raised_as_requests_errors(self):
+        with self.assertRaises(ConnectionError):
+            self.get_client().get("/tasks/2", {})
+
+    def test_server_error(self):
+        with self.assertRaises(ServerError):
+            self.get_client().get("/tasks/3", {})
+
+    def test_server_error_rest_client(self):
+        client = RestClient(session=self.get_transport())
+        with self.assertRaises(ServerError) as context:
+            client.get("/tasks/3")
+        self.assertEqual(503, context.exception.status)
+        self.assertEqual({"gid": "1", "auth": "Bearer foo"}, client.get("/tasks/1"))
+
+    @override_settings(
+        ASANA_ACCESS_TOKEN="foo",
+        ASANA_WORKSPACE=None,
+        DJASANA_TRANSPORT="djasana.connect.HTTPXTransport",
+    )
+    def test_setting(self):
+        self.assertIsInstance(client_connect().session, HTTPXTransport)
+
+    @override_settings(
+        ASANA_ACCESS_TOKEN="foo",
+        ASANA_WORKSPACE=None,
+        DJASANA_TRANSPORT="djasana.connect.HTTPXTransport",
+    )
+    def test_async_engine_authenticated(self):
+        """Asserts the async engine authenticates like a client using the
+        transport"""
+        async_client = httpx.AsyncClient
+
+        def get_mock_client(**kwargs):
+            return async_client(transport=httpx.MockTransport(self.handler), **kwargs)
+
+        client = client_connect()
+        with patch("httpx.AsyncClient", get_mock_client):
+            with AsyncFetcher(client) as fetcher:
+                results = fetcher.fetch_tasks(
+                    [{"gid": "1"}], attachments=False, stories=False
+                )
+        self.assertEqual("Bearer foo", results[("task", "1")]["auth"])
+
+
+@unittest.skipIf(httpx is not None, "httpx is installed")
+class HTTPXMissingTestCase(SimpleTestCase):
+    def test_improperly_configured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            HTTPXTransport(token="foo")
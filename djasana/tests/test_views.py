@@ -2,13 +2,16 @@ import json
 from unittest.mock import patch
 
 from asana.error import ForbiddenError
+from django.core.cache import cache
 from django.http import Http404
 from django.test import override_settings, TestCase, RequestFactory
 from django.urls import reverse
 
 from djasana import models, views
+from djasana.connect import CircuitOpenError, reset_clients
 from djasana.tests.fixtures import attachment, project, story, task, user
 from djasana.utils import sign_sha256_hmac
+from djasana.webhooks import event_fingerprints, webhook_cache
 
 
 @override_settings(
@@ -53,6 +56,14 @@ class WebhookViewTestCase(TestCase):
             ]
         }
 
+    def setUp(self):
+        # Clients are kept per thread; each test mocks a new one.
+        reset_clients()
+        # Webhooks are rolled back between tests without invalidating the cache.
+        cache.clear()
+        webhook_cache.clear()
+        event_fingerprints.reset_counts()
+
     def _get_mock_response(self, mock_client, data):
         message = json.dumps(data)
         signature = sign_sha256_hmac(self.secret, message)
@@ -141,6 +152,41 @@ class WebhookViewTestCase(TestCase):
         response = views.WebhookView.as_view()(request, remote_id=3)
         self.assertEqual(403, response.status_code)
 
+    def test_bad_signature_cached(self):
+        """Asserts a bad signature is rejected without queries once cached"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        request = self.factory.post(
+            "",
+            content_type="application/json",
+            data=json.dumps(self.data),
+            **{"X-Hook-Signature": "x" * 64}
+        )
+        views.WebhookView.as_view()(request, remote_id=3)
+        with self.assertNumQueries(0):
+            response = views.WebhookView.as_view()(request, remote_id=3)
+        self.assertEqual(403, response.status_code)
+        with self.assertRaises(Http404):
+            views.WebhookView.as_view()(request, remote_id=99)
+        with self.assertNumQueries(0), self.assertRaises(Http404):
+            views.WebhookView.as_view()(request, remote_id=99)
+
+    @patch("djasana.connect.Client")
+    def test_secret_rotated(self, mock_client):
+        """Asserts a delivery signed with a new secret is accepted"""
+        webhook = models.Webhook.objects.create(project=self.project, secret="y" * 64)
+        webhook_cache.get(3)
+        # As by another process, which only clears the shared cache
+        models.Webhook.objects.filter(pk=webhook.pk).update(secret=self.secret)
+        cache.clear()
+        response = self._get_mock_response(mock_client, {"events": []})
+        self.assertEqual(200, response.status_code)
+
+    def test_project_deleted_invalidates(self):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self.assertEqual((True, self.secret), webhook_cache.get(3))
+        models.Project.objects.filter(remote_id=3).delete()
+        self.assertEqual((False, None), webhook_cache.get(3))
+
     def test_bad_project_id(self):
         """Asserts a malicious endpoint posts a wrong project id"""
         request = self.factory.post(
@@ -188,6 +234,162 @@ class WebhookViewTestCase(TestCase):
         except models.Attachment.DoesNotExist:
             self.fail("Attachment not created")
 
+    @patch("djasana.connect.Client")
+    def test_coalesced(self, mock_client):
+        """Asserts a task changed by several events is fetched once"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        data = {"events": [self.data["events"][0]] * 3}
+        response = self._get_mock_response(mock_client, data)
+        self.assertEqual(200, response.status_code)
+        mock_client.access_token().tasks.find_by_id.assert_called_once_with("1337")
+        self.assertTrue(models.Task.objects.filter(remote_id=1337).exists())
+
+    @patch("djasana.connect.Client")
+    def test_change_applied(self, mock_client):
+        """Asserts a change carried by an event is applied without a fetch"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        models.Task.objects.create(remote_id=1337, name="Old task Name")
+        event = dict(
+            self.data["events"][0],
+            change={"field": "name", "action": "changed", "new_value": "New Name"},
+        )
+        response = self._get_mock_response(mock_client, {"events": [event]})
+        self.assertEqual(200, response.status_code)
+        mock_client.access_token().tasks.find_by_id.assert_not_called()
+        self.assertEqual("New Name", models.Task.objects.get(remote_id=1337).name)
+
+    @patch("djasana.connect.Client")
+    def test_duplicate_delivery(self, mock_client):
+        """Asserts events delivered again are skipped"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        for _ in range(2):
+            response = self._get_mock_response(mock_client, self.data)
+            self.assertEqual(200, response.status_code)
+        mock_client.access_token().tasks.find_by_id.assert_called_once_with("1337")
+        self.assertEqual((1, 1), (event_fingerprints.hits, event_fingerprints.misses))
+
+    @patch("djasana.connect.Client")
+    def test_claimed_delivery_skipped(self, mock_client):
+        """Asserts events claimed by another process, still handling them, are
+        skipped"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        self.assertEqual(
+            self.data["events"], event_fingerprints.claim(self.data["events"])
+        )
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(mock_client.access_token().tasks.find_by_id.called)
+
+    @patch("djasana.connect.Client")
+    def test_failure_releases_claims(self, mock_client):
+        """Asserts events that failed are handled when delivered again"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        message = json.dumps(self.data)
+        request = self.factory.post(
+            "",
+            content_type="application/json",
+            data=message,
+            **{"X-Hook-Signature": sign_sha256_hmac(self.secret, message)}
+        )
+        mock_client.access_token().tasks.find_by_id.side_effect = ValueError("Boom")
+        with self.assertRaises(ValueError):
+            views.WebhookView.as_view()(request, remote_id=3)
+        mock_client.access_token().tasks.find_by_id.side_effect = None
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(models.Task.objects.filter(remote_id=1337).exists())
+
+    @patch("djasana.connect.Client")
+    def test_multi_homed_task_added(self, mock_client):
+        """Asserts a task added to two projects at once is added to both"""
+        other_project = models.Project.objects.create(
+            remote_id=4, name="Other Project", public=True, workspace=self.workspace
+        )
+        for project_ in (self.project, other_project):
+            models.Webhook.objects.create(project=project_, secret=self.secret)
+        mock_client.access_token().tasks.find_by_id.side_effect = lambda gid: task(
+            gid=gid
+        )
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        for remote_id in (3, 4):
+            event = dict(
+                self.data["events"][0],
+                action="added",
+                parent={"gid": str(remote_id), "resource_type": "project"},
+            )
+            message = json.dumps({"events": [event]})
+            request = self.factory.post(
+                "",
+                content_type="application/json",
+                data=message,
+                **{"X-Hook-Signature": sign_sha256_hmac(self.secret, message)}
+            )
+            response = views.WebhookView.as_view()(request, remote_id=remote_id)
+            self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [3, 4],
+            sorted(
+                models.Task.objects.get(remote_id=1337).projects.values_list(
+                    "remote_id", flat=True
+                )
+            ),
+        )
+        self.assertEqual(0, event_fingerprints.hits)
+
+    @override_settings(DJASANA_EVENT_DEDUPE_TIMEOUT=0)
+    @patch("djasana.connect.Client")
+    def test_duplicate_delivery_dedupe_disabled(self, mock_client):
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        for _ in range(2):
+            self._get_mock_response(mock_client, self.data)
+        self.assertEqual(2, mock_client.access_token().tasks.find_by_id.call_count)
+
+    @patch("djasana.connect.Client")
+    def test_circuit_open_released(self, mock_client):
+        """Asserts events deferred while Asana is failing are applied when sent again"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().attachments.find_by_task.return_value = []
+        mock_client.access_token().tasks.find_by_id.side_effect = CircuitOpenError(30)
+        message = json.dumps(self.data)
+        request = self.factory.post(
+            "",
+            content_type="application/json",
+            data=message,
+            **{"X-Hook-Signature": sign_sha256_hmac(self.secret, message)}
+        )
+        response = views.WebhookView.as_view()(request, remote_id=3)
+        self.assertEqual(503, response.status_code)
+        mock_client.access_token().tasks.find_by_id.side_effect = None
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(models.Task.objects.filter(remote_id=1337).exists())
+
+    @patch("djasana.connect.Client")
+    def test_circuit_open(self, mock_client):
+        """Asserts events are deferred while Asana is failing"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        mock_client.access_token().tasks.find_by_id.side_effect = CircuitOpenError(30)
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(503, response.status_code)
+        self.assertEqual("31", response["Retry-After"])
+
+    @override_settings(DJASANA_WEBHOOK_INBOX=True)
+    @patch("djasana.connect.Client")
+    def test_inbox(self, mock_client):
+        """Asserts events are stored for process_asana_events"""
+        models.Webhook.objects.create(project=self.project, secret=self.secret)
+        response = self._get_mock_response(mock_client, self.data)
+        self.assertEqual(200, response.status_code)
+        event = models.WebhookEvent.objects.get()
+        self.assertEqual(3, event.project_remote_id)
+        self.assertEqual(self.data["events"][0], event.payload)
+        mock_client.access_token().tasks.find_by_id.assert_not_called()
+        self.assertFalse(models.Task.objects.exists())
+
     @patch("djasana.connect.Client")
     def test_bad_task_id(self, mock_client):
         """Asserts an event is received for a task that is now deleted in Asana"""
@@ -5,7 +5,11 @@ import logging
 from asana.error import InvalidRequestError
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from djasana.batch import find_by_ids
+from djasana.bulk import BulkWriter
 from djasana.models import (
     Attachment,
     CustomField,
@@ -21,6 +25,50 @@ from djasana.models import (
 
 logger = logging.getLogger(__name__)
 
+# The fields of a task that sync_task uses, for requesting as opt_fields.
+TASK_FIELDS = (
+    "assignee.name",
+    "assignee_status",
+    "completed",
+    "completed_at",
+    "created_at",
+    "custom_fields.enum_value.name",
+    "custom_fields.name",
+    "custom_fields.number_value",
+    "custom_fields.precision",
+    "custom_fields.resource_subtype",
+    "custom_fields.text_value",
+    "dependencies",
+    "due_at",
+    "due_on",
+    "followers",
+    "html_notes",
+    "modified_at",
+    "name",
+    "notes",
+    "num_subtasks",
+    "parent",
+    "resource_subtype",
+    "resource_type",
+    "start_on",
+    "tags.name",
+)
+
+# The fields of a story that sync_story uses, for requesting as opt_fields.
+STORY_FIELDS = (
+    "created_at",
+    "created_by.name",
+    "html_text",
+    "is_edited",
+    "is_pinned",
+    "resource_subtype",
+    "resource_type",
+    "source",
+    "target",
+    "text",
+    "type",
+)
+
 
 def sign_sha256_hmac(secret, message):
     if not isinstance(message, bytes):
@@ -48,6 +96,15 @@ def set_webhook(client, project_id):
         logger.warning("Target url: %s", target)
 
 
+def has_fields(resource_dict, fields):
+    """Returns True if a resource dict has every one of fields.
+
+    For example, a task listed with opt_fields=TASK_FIELDS has everything
+    sync_task needs, so it does not need to be fetched again.
+    """
+    return all(field.split(".")[0] in resource_dict for field in fields)
+
+
 def pop_unsupported_fields(instance_dict, model):
     """Pops unsupported fields from a dict that is to be used in get_or_create.
 
@@ -69,28 +126,46 @@ def pop_unsupported_fields(instance_dict, model):
         instance_dict.pop(field)
 
 
-def sync_attachment(client, task, attachment_id):
-    attachment_dict = client.attachments.find_by_id(attachment_id)
+def _add_user(writer, user_dict):
+    """Buffers a user, to be created if it does not exist, and returns its id."""
+    writer.add(
+        User, {"remote_id": user_dict["gid"], "name": user_dict["name"]}, update=False
+    )
+    return user_dict["gid"]
+
+
+def sync_attachment(
+    client, task, attachment_id, attachment_dict=None, update=False, writer=None
+):
+    """Creates the attachment, or if update is True, creates or updates it.
+
+    If a BulkWriter is given, the attachment is buffered in it to be written on
+    its next flush.
+    """
+    if attachment_dict is None:
+        attachment_dict = client.attachments.find_by_id(attachment_id)
     logger.debug(attachment_dict)
-    remote_id = attachment_dict["gid"]
     attachment_dict.pop("num_annotations", None)
     attachment_dict.pop("num_incomplete_annotations", None)
     if attachment_dict["parent"]:
         attachment_dict["parent"] = task
     pop_unsupported_fields(attachment_dict, Attachment)
-    Attachment.objects.get_or_create(remote_id=remote_id, defaults=attachment_dict)
+    attachment_dict["remote_id"] = attachment_dict["gid"]
+    (writer or BulkWriter(flush_size=1)).add(Attachment, attachment_dict, update)
+
 
+def sync_project(client, project_dict, writer=None):
+    """Creates or updates the project, and returns it.
 
-def sync_project(client, project_dict):
+    If a BulkWriter is given, it is used for the project and its related objects,
+    and flushed.
+    """
     remote_id = project_dict["gid"]
+    writer = writer or BulkWriter()
     if project_dict["owner"]:
-        owner = project_dict.pop("owner")
-        User.objects.get_or_create(
-            remote_id=owner["gid"], defaults={"name": owner["name"]}
-        )
-        project_dict["owner_id"] = owner["gid"]
+        project_dict["owner_id"] = _add_user(writer, project_dict.pop("owner"))
     team = project_dict.pop("team")
-    Team.objects.get_or_create(remote_id=team["gid"], defaults={"name": team["name"]})
+    writer.add(Team, {"remote_id": team["gid"], "name": team["name"]}, update=False)
     project_dict["team_id"] = team["gid"]
     project_dict["workspace_id"] = project_dict.pop("workspace")["gid"]
     custom_field_settings = project_dict.pop("custom_field_settings", None)
@@ -100,54 +175,118 @@ def sync_project(client, project_dict):
     followers_dict = project_dict.pop("followers")
     project_status_dict = project_dict.pop("current_status", None)
     pop_unsupported_fields(project_dict, Project)
-    project = Project.objects.update_or_create(
-        remote_id=remote_id, defaults=project_dict
-    )[0]
-    member_ids = [member["gid"] for member in members_dict]
-    members = User.objects.filter(id__in=member_ids)
-    project.members.set(members)
-    follower_ids = [follower["gid"] for follower in followers_dict]
-    followers = User.objects.filter(id__in=follower_ids)
-    project.followers.set(followers)
     if project_status_dict:
         current_status_id = project_status_dict.pop("gid")
         project_status = ProjectStatus.objects.update_or_create(
             remote_id=current_status_id, defaults=project_status_dict
         )[0]
-        project.current_status = project_status
-        project.save(update_fields=["current_status"])
+        project_dict["current_status"] = project_status
+    project_dict["remote_id"] = remote_id
+    writer.add(Project, project_dict)
+    writer.set_related(
+        Project, remote_id, "members", [member["gid"] for member in members_dict]
+    )
+    writer.set_related(
+        Project,
+        remote_id,
+        "followers",
+        [follower["gid"] for follower in followers_dict],
+    )
+    writer.flush()
+    project = Project.objects.get(remote_id=remote_id)
     if custom_field_settings:
         sync_custom_fields(
             client,
             custom_field_settings,
             project_dict["workspace_id"],
             project.remote_id,
+            writer=writer,
         )
     return project
 
 
-def sync_story(remote_id, story_dict):
+def _clean_story_dict(story_dict, writer):
     if story_dict["created_by"]:
-        user = User.objects.get_or_create(
-            remote_id=story_dict["created_by"]["gid"],
-            defaults={"name": story_dict["created_by"]["name"]},
-        )[0]
-        story_dict["created_by"] = user
+        story_dict["created_by_id"] = _add_user(writer, story_dict.pop("created_by"))
     if story_dict["target"]:
         story_dict["target"] = story_dict["target"]["gid"]
     pop_unsupported_fields(story_dict, Story)
-    if "text" in story_dict:
+    if story_dict.get("text"):
         story_dict["text"] = story_dict["text"][:1024]  # Truncate text if too long
-    Story.objects.get_or_create(remote_id=remote_id, defaults=story_dict)
+    story_dict["remote_id"] = story_dict["gid"]
+
+
+def sync_story(remote_id, story_dict, writer=None):
+    """Creates the story if it does not exist.
+
+    If a BulkWriter is given, the story is buffered in it to be written on its
+    next flush.
+    """
+    writer_ = writer or BulkWriter()
+    story_dict["gid"] = remote_id
+    _clean_story_dict(story_dict, writer_)
+    writer_.add(Story, story_dict, update=False)
+    if writer is None:
+        writer_.flush()
+
+
+def sync_stories(story_dicts, update=False, writer=None):
+    """Creates the stories that do not exist yet, in one batch.
+
+    Like sync_story, existing stories are left as they are, unless update is True.
+    If a BulkWriter is given, the stories are buffered in it to be written on its
+    next flush.
+    """
+    writer_ = writer or BulkWriter()
+    for story_dict in story_dicts:
+        _clean_story_dict(story_dict, writer_)
+        writer_.add(Story, story_dict, update)
+    if writer is None:
+        writer_.flush()
+
 
+def parse_remote_datetime(value):
+    """Returns the datetime of an Asana timestamp, like "2012-02-22T02:06:58.147Z",
+    made naive if USE_TZ is off so that it can be saved, or None."""
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value and timezone.is_aware(value) and not settings.USE_TZ:
+        value = timezone.make_naive(value)
+    return value or None
 
-def sync_task(remote_id, task_dict, project, sync_tags=False):
+
+def get_unchanged_task(remote_id, task_dict, project):
+    """Returns the task if it was synced to this project as last modified in Asana,
+    so it has nothing to update, else None."""
+    modified_at = parse_remote_datetime(task_dict.get("modified_at"))
+    if not modified_at:
+        return None
+    return Task.objects.filter(
+        remote_id=remote_id,
+        remote_modified_at=modified_at,
+        projects=project,
+    ).first()
+
+
+def sync_task(
+    remote_id, task_dict, project, sync_tags=False, skip_unchanged=True, writer=None
+):
+    """Creates or updates the task, unless it is unchanged since its last sync.
+
+    Returns the task. If a BulkWriter is given, the task is instead buffered in it
+    to be written on its next flush, and None is returned.
+    """
+    if skip_unchanged:
+        task = get_unchanged_task(remote_id, task_dict, project)
+        if task:
+            logger.debug("Task %s is unchanged", remote_id)
+            return task
+    writer_ = writer or BulkWriter()
+    task_dict["remote_modified_at"] = parse_remote_datetime(
+        task_dict.get("modified_at")
+    )
     if task_dict["assignee"]:
-        user = User.objects.get_or_create(
-            remote_id=task_dict["assignee"]["gid"],
-            defaults={"name": task_dict["assignee"]["name"]},
-        )[0]
-        task_dict["assignee"] = user
+        task_dict["assignee_id"] = _add_user(writer_, task_dict.pop("assignee"))
     for key in (
         "hearts",
         "liked",
@@ -161,42 +300,54 @@ def sync_task(remote_id, task_dict, project, sync_tags=False):
     followers_dict = task_dict.pop("followers")
     tags_dict = task_dict.pop("tags")
     pop_unsupported_fields(task_dict, Task)
-    task = Task.objects.update_or_create(remote_id=remote_id, defaults=task_dict)[0]
-    follower_ids = [follower["gid"] for follower in followers_dict]
-    followers = User.objects.filter(id__in=follower_ids)
-    task.followers.set(followers)
+    task_dict["remote_id"] = remote_id
+    writer_.add(Task, task_dict)
+    writer_.set_related(
+        Task, remote_id, "followers", [follower["gid"] for follower in followers_dict]
+    )
     if sync_tags:
         for tag_ in tags_dict:
-            tag = Tag.objects.get_or_create(
-                remote_id=tag_["gid"], defaults={"name": tag_["name"]}
-            )[0]
-            task.tags.add(tag)
-    task.projects.add(project)
-    return task
+            writer_.add(
+                Tag, {"remote_id": tag_["gid"], "name": tag_["name"]}, update=False
+            )
+        writer_.set_related(
+            Task, remote_id, "tags", [tag_["gid"] for tag_ in tags_dict], clear=False
+        )
+    writer_.set_related(Task, remote_id, "projects", [project.remote_id], clear=False)
+    if writer is None:
+        writer_.flush()
+        return Task.objects.get(remote_id=remote_id)
+    return None
 
 
-def sync_custom_fields(client, custom_field_settings, workspace_id, project_id):
-    synced_ids = []
+def sync_custom_fields(
+    client, custom_field_settings, workspace_id, project_id, writer=None
+):
+    writer = writer or BulkWriter()
+    custom_field_settings = list(custom_field_settings)
+    custom_field_ids = list(
+        dict.fromkeys(
+            setting["custom_field"]["gid"] for setting in custom_field_settings
+        )
+    )
+    custom_field_dicts = find_by_ids(client, "custom_fields", custom_field_ids)
+    for custom_field_remote_id, custom_field_dict in zip(
+        custom_field_ids, custom_field_dicts
+    ):
+        if custom_field_dict["created_by"]:
+            custom_field_dict["created_by_id"] = _add_user(
+                writer, custom_field_dict.pop("created_by")
+            )
+        pop_unsupported_fields(custom_field_dict, CustomField)
+        custom_field_dict["remote_id"] = custom_field_remote_id
+        writer.add(CustomField, custom_field_dict)
     for setting in custom_field_settings:
-        custom_field_mini_dict = setting.pop("custom_field")
+        custom_field_remote_id = setting.pop("custom_field")["gid"]
         setting.pop("project")
-        custom_field_remote_id = custom_field_mini_dict["gid"]
-        if custom_field_remote_id not in synced_ids:
-            custom_field_dict = client.custom_fields.find_by_id(custom_field_remote_id)
-            if custom_field_dict["created_by"]:
-                user = User.objects.get_or_create(
-                    remote_id=custom_field_dict["created_by"]["gid"],
-                    defaults={"name": custom_field_dict["created_by"]["name"]},
-                )[0]
-                custom_field_dict["created_by"] = user
-            CustomField.objects.update_or_create(
-                remote_id=custom_field_remote_id, defaults=custom_field_dict
-            )
-            synced_ids.append(custom_field_remote_id)
-        setting_remote_id = setting["gid"]
         pop_unsupported_fields(setting, CustomFieldSetting)
+        setting["remote_id"] = setting["gid"]
         setting["custom_field_id"] = custom_field_remote_id
         setting["project_id"] = project_id
-        CustomFieldSetting.objects.update_or_create(
-            remote_id=setting_remote_id, workspace_id=workspace_id, defaults=setting
-        )
+        setting["workspace_id"] = workspace_id
+        writer.add(CustomFieldSetting, setting)
+    writer.flush()
@@ -0,0 +1,167 @@
+"""Caching of what the webhook view needs to authenticate and deduplicate
+deliveries."""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Project, Webhook
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookCache(object):
+    """Caches for each project whether it has been synced and the secret of its
+    webhook, so that the webhook view authenticates deliveries without queries.
+
+    Up to size entries are kept in each process, least recently used first out,
+    backed by the Django cache for timeout seconds. Entries are invalidated when a
+    webhook is saved or deleted, or a project deleted. Since another process may
+    have invalidated an entry, the view checks a delivery it would reject against
+    the Django cache again with refresh before rejecting it.
+    """
+
+    key_prefix = "djasana-webhook:"
+
+    def __init__(self, size=1024, timeout=3600):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, remote_id, refresh=False):
+        """Returns whether the project with the remote id exists and the secret of
+        its webhook, or None. With refresh, the entry of this process is ignored."""
+        remote_id = int(remote_id)
+        if not refresh:
+            with self._lock:
+                entry = self._entries.get(remote_id)
+                if entry is not None:
+                    self._entries.move_to_end(remote_id)
+                    return entry
+        key = f"{self.key_prefix}{remote_id}"
+        entry = cache.get(key)
+        if entry is None:
+            entry = self._load(remote_id)
+            cache.set(key, entry, self.timeout)
+        entry = tuple(entry)
+        with self._lock:
+            self._entries[remote_id] = entry
+            self._entries.move_to_end(remote_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _load(remote_id):
+        if not Project.objects.filter(remote_id=remote_id).exists():
+            return False, None
+        webhook = Webhook.objects.filter(project_id=remote_id).order_by("id").last()
+        return True, webhook.secret if webhook else None
+
+    def invalidate(self, remote_id):
+        remote_id = int(remote_id)
+        with self._lock:
+            self._entries.pop(remote_id, None)
+        cache.delete(f"{self.key_prefix}{remote_id}")
+
+    def clear(self):
+        """Forgets the entries of this process."""
+        with self._lock:
+            self._entries.clear()
+
+
+class EventFingerprints(object):
+    """Claims the events the webhook view handles, so that copies of them are
+    skipped, as when Asana delivers them again or through the webhooks of each
+    project of a task, even while another process is handling them.
+
+    Events are told apart by the gid of their resource, their action, their
+    parent, when they happened and their change, so that a task added to two
+    projects at once is added to both. Their fingerprints are added to the Django
+    cache, which claims them atomically, for DJASANA_EVENT_DEDUPE_TIMEOUT seconds,
+    an hour by default; set it to 0 to handle every copy. Claims of events that
+    could not be handled are released. hits counts the copies skipped by this
+    process, misses the events it claimed.
+    """
+
+    key_prefix = "djasana-event:"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return getattr(settings, "DJASANA_EVENT_DEDUPE_TIMEOUT", 3600)
+
+    def get_key(self, event):
+        resource = event.get("resource") or {}
+        parent = event.get("parent") or {}
+        fingerprint = json.dumps(
+            [
+                resource.get("gid"),
+                event.get("action"),
+                parent.get("gid"),
+                parent.get("resource_type"),
+                event.get("created_at"),
+                event.get("change"),
+            ],
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+        return self.key_prefix + digest
+
+    def claim(self, events):
+        """Claims the events not claimed within the timeout, returning them in
+        order."""
+        if not self.timeout:
+            return list(events)
+        claimed = []
+        keys = set()
+        for event in events:
+            key = self.get_key(event)
+            # Copies within a delivery are skipped too
+            if key in keys:
+                continue
+            keys.add(key)
+            if cache.add(key, True, self.timeout):
+                claimed.append(event)
+        with self._lock:
+            self.hits += len(events) - len(claimed)
+            self.misses += len(claimed)
+        if len(claimed) < len(events):
+            logger.debug("Skipped %s events seen before", len(events) - len(claimed))
+        return claimed
+
+    def release(self, events):
+        """Releases the claims of events that could not be handled, so that they are
+        handled when delivered again."""
+        if self.timeout and events:
+            cache.delete_many([self.get_key(event) for event in events])
+
+    def reset_counts(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+webhook_cache = WebhookCache(**getattr(settings, "DJASANA_WEBHOOK_CACHE", {}))
+event_fingerprints = EventFingerprints()
+
+
+@receiver(post_save, sender=Webhook)
+@receiver(post_delete, sender=Webhook)
+def invalidate_webhook(sender, instance, **kwargs):
+    webhook_cache.invalidate(instance.project_id)
+
+
+@receiver(post_delete, sender=Project)
+def invalidate_project(sender, instance, **kwargs):
+    webhook_cache.invalidate(instance.remote_id)
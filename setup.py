@@ -118,4 +118,8 @@ setup(
         "django-braces>=1.14",
         "requests>=2.31.0",
     ],
+    extras_require={
+        "async": ["httpx>=0.23"],
+        "http2": ["httpx[http2]>=0.23"],
+    },
 )